@@ -58,19 +58,23 @@ CREATE TABLE IF NOT EXISTS equipos (
     fecha_garantia_fin DATE,
     costo_compra DECIMAL(12, 2),
     especificaciones JSONB, -- Detalles técnicos flexibles
-    fecha_registro TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    fecha_fin_vida_util DATE, -- fecha_compra + vida útil de la categoría, la mantiene un trigger
+    fecha_registro TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    fecha_actualizacion TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Tabla: movimientos_equipos
+-- Particionada por mes de fecha_movimiento (ver crear_particiones_mensuales)
 CREATE TABLE IF NOT EXISTS movimientos_equipos (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
     equipo_id UUID REFERENCES equipos(id),
     ubicacion_origen_id UUID REFERENCES ubicaciones(id),
     ubicacion_destino_id UUID REFERENCES ubicaciones(id),
     usuario_id UUID REFERENCES usuarios(id), -- Quién realizó el movimiento
-    fecha_movimiento TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    motivo TEXT
-);
+    fecha_movimiento TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    motivo TEXT,
+    PRIMARY KEY (id, fecha_movimiento)
+) PARTITION BY RANGE (fecha_movimiento);
 
 -- Tabla: contratos
 CREATE TABLE IF NOT EXISTS contratos (
@@ -85,10 +89,32 @@ CREATE TABLE IF NOT EXISTS contratos (
     estado VARCHAR(20) DEFAULT 'vigente' -- 'vigente', 'vencido', 'cancelado'
 );
 
+-- Tabla: planes_mantenimiento
+CREATE TABLE IF NOT EXISTS planes_mantenimiento (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    nombre VARCHAR(100) NOT NULL,
+    tipo VARCHAR(50) NOT NULL DEFAULT 'preventivo',
+    prioridad VARCHAR(20) DEFAULT 'media',
+    descripcion TEXT,
+    tecnico_responsable VARCHAR(100),
+    frecuencia_valor INTEGER NOT NULL CHECK (frecuencia_valor > 0),
+    frecuencia_unidad VARCHAR(10) NOT NULL CHECK (frecuencia_unidad IN ('dias', 'semanas', 'meses', 'anios')),
+    fecha_inicio DATE NOT NULL,
+    fecha_fin DATE,
+    -- Objetivo: categoría, ubicación y/o lista explícita de equipos (se combinan con AND)
+    categoria_id UUID REFERENCES categorias_equipos(id),
+    ubicacion_id UUID REFERENCES ubicaciones(id),
+    equipo_ids UUID[],
+    generado_hasta DATE, -- Última fecha materializada en mantenimientos
+    activo BOOLEAN DEFAULT TRUE,
+    fecha_creacion TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Tabla: mantenimientos
 CREATE TABLE IF NOT EXISTS mantenimientos (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     equipo_id UUID REFERENCES equipos(id),
+    plan_id UUID REFERENCES planes_mantenimiento(id), -- NULL si se programó manualmente
     tipo VARCHAR(50) NOT NULL, -- 'preventivo', 'correctivo'
     prioridad VARCHAR(20) DEFAULT 'media', -- 'baja', 'media', 'alta', 'critica'
     estado VARCHAR(50) DEFAULT 'programado', -- 'programado', 'en_proceso', 'completado', 'cancelado'
@@ -98,29 +124,141 @@ CREATE TABLE IF NOT EXISTS mantenimientos (
     descripcion TEXT,
     tecnico_responsable VARCHAR(100),
     notas_tecnicas TEXT,
-    fecha_creacion TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    fecha_creacion TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    fecha_actualizacion TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Tabla: notificaciones
+-- Particionada por mes de fecha_creacion; la retención archiva o borra los meses ya leídos
 CREATE TABLE IF NOT EXISTS notificaciones (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
     tipo VARCHAR(50) NOT NULL, -- 'mantenimiento', 'garantia', 'obsolescencia', 'sistema'
     mensaje TEXT NOT NULL,
-    fecha_creacion TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    fecha_creacion TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
     leida BOOLEAN DEFAULT FALSE,
     prioridad VARCHAR(20) DEFAULT 'media',
-    datos_extra JSONB
+    datos_extra JSONB,
+    clave_dedup VARCHAR(200), -- tipo:condición:entidad:periodo, la asignan los agentes
+    PRIMARY KEY (id, fecha_creacion)
+) PARTITION BY RANGE (fecha_creacion);
+
+-- Tabla: agent_runs
+CREATE TABLE IF NOT EXISTS agent_runs (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    lote_id UUID, -- ejecuciones lanzadas juntas por /run-all-agents
+    agente VARCHAR(50) NOT NULL,
+    inicio TIMESTAMP WITH TIME ZONE NOT NULL,
+    duracion_ms INTEGER,
+    filas INTEGER, -- filas evaluadas por el agente
+    notificaciones INTEGER, -- notificaciones insertadas o actualizadas
+    error TEXT
 );
 
+-- Tabla: agent_watermarks
+-- Última ejecución correcta de cada agente; las siguientes solo revisan lo que cambió
+CREATE TABLE IF NOT EXISTS agent_watermarks (
+    agente VARCHAR(50) PRIMARY KEY,
+    marca TIMESTAMP WITH TIME ZONE NOT NULL, -- inicio de la ejecución (reloj de la base)
+    fecha DATE NOT NULL -- fecha de la ejecución, para umbrales por fecha
+);
+
+-- Tabla: agent_schedule
+-- Último horario (slot) ejecutado por el planificador de cada agente, compartido entre réplicas
+CREATE TABLE IF NOT EXISTS agent_schedule (
+    agente VARCHAR(50) PRIMARY KEY,
+    ultima_programada TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Particiones mensuales
+-- Crea <tabla>_AAAA_MM para `meses` meses desde `desde` y la partición por defecto, que
+-- recoge fechas fuera de rango. Si la partición por defecto ya tiene filas de un mes que se
+-- va a crear, esas filas pasan a la nueva partición antes de adjuntarla. El agent_service
+-- crea los meses siguientes y aplica la retención; las particiones archivadas pasan al
+-- esquema archivo.
+CREATE SCHEMA IF NOT EXISTS archivo;
+
+CREATE OR REPLACE FUNCTION crear_particiones_mensuales(tabla TEXT, desde DATE, meses INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    inicio DATE := date_trunc('month', desde);
+    fin DATE;
+    particion TEXT;
+    defecto TEXT := tabla || '_default';
+    columna TEXT;
+    pendientes BOOLEAN;
+    creadas INTEGER := 0;
+BEGIN
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I DEFAULT', defecto, tabla);
+    SELECT a.attname INTO columna
+    FROM pg_partitioned_table p
+    JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0]
+    WHERE p.partrelid = tabla::regclass;
+    FOR i IN 0..meses - 1 LOOP
+        particion := tabla || to_char(inicio, '_YYYY_MM');
+        fin := inicio + INTERVAL '1 month';
+        IF to_regclass(particion) IS NULL THEN
+            EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE %I >= %L AND %I < %L)',
+                           defecto, columna, inicio, columna, fin) INTO pendientes;
+            IF pendientes THEN
+                -- CREATE ... PARTITION OF fallaría con filas del mes en la partición por
+                -- defecto: se crea la tabla suelta, se mueven las filas y se adjunta
+                EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                               particion, tabla);
+                EXECUTE format('WITH movidas AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) '
+                               'INSERT INTO %I SELECT * FROM movidas',
+                               defecto, columna, inicio, columna, fin, particion);
+                EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                               tabla, particion, inicio, fin);
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               particion, tabla, inicio, fin);
+            END IF;
+            creadas := creadas + 1;
+        END IF;
+        inicio := fin;
+    END LOOP;
+    RETURN creadas;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT crear_particiones_mensuales('movimientos_equipos', (CURRENT_DATE - INTERVAL '1 month')::date, 5);
+SELECT crear_particiones_mensuales('notificaciones', (CURRENT_DATE - INTERVAL '1 month')::date, 5);
+
 -- Índices
 CREATE INDEX idx_equipos_codigo ON equipos(codigo_inventario);
 CREATE INDEX idx_equipos_categoria ON equipos(categoria_id);
 CREATE INDEX idx_equipos_ubicacion ON equipos(ubicacion_actual_id);
 CREATE INDEX idx_equipos_estado ON equipos(estado);
-CREATE INDEX idx_mantenimientos_equipo ON mantenimientos(equipo_id);
-CREATE INDEX idx_mantenimientos_fecha ON mantenimientos(fecha_programada);
-CREATE INDEX idx_movimientos_equipo ON movimientos_equipos(equipo_id);
-CREATE INDEX idx_notificaciones_leida ON notificaciones(leida);
+-- Escaneos incrementales de los agentes
+CREATE INDEX idx_equipos_fin_vida_util ON equipos(fecha_fin_vida_util);
+CREATE INDEX idx_equipos_garantia_fin ON equipos(fecha_garantia_fin);
+CREATE INDEX idx_equipos_actualizacion ON equipos(fecha_actualizacion);
+CREATE INDEX idx_mantenimientos_actualizacion ON mantenimientos(fecha_actualizacion);
+-- GET /mantenimientos: índices que terminan en la clave de orden + id para que la
+-- paginación por cursor sea un range scan sin Sort. Orden por fecha_programada: uno por
+-- combinación de estado/tipo/equipo_id. Orden por fecha_creacion: sin filtro o por
+-- estado; con tipo, equipo_id o rango de fechas se usa un índice de filtro y se ordena
+-- el resultado. scripts/check_mantenimientos_indexes.py comprueba que ninguna
+-- combinación recorra la tabla completa.
+CREATE INDEX idx_mantenimientos_fecha ON mantenimientos(fecha_programada, id);
+CREATE INDEX idx_mantenimientos_equipo ON mantenimientos(equipo_id, fecha_programada, id);
+CREATE INDEX idx_mantenimientos_estado_fecha ON mantenimientos(estado, fecha_programada, id);
+CREATE INDEX idx_mantenimientos_tipo_fecha ON mantenimientos(tipo, fecha_programada, id);
+CREATE INDEX idx_mantenimientos_estado_tipo_fecha ON mantenimientos(estado, tipo, fecha_programada, id);
+CREATE INDEX idx_mantenimientos_creacion ON mantenimientos(fecha_creacion, id);
+CREATE INDEX idx_mantenimientos_estado_creacion ON mantenimientos(estado, fecha_creacion, id);
+-- Garantiza que regenerar un plan no duplique ocurrencias
+CREATE UNIQUE INDEX idx_mantenimientos_plan_ocurrencia ON mantenimientos(plan_id, equipo_id, fecha_programada) WHERE plan_id IS NOT NULL;
+CREATE INDEX idx_movimientos_equipo ON movimientos_equipos(equipo_id, fecha_movimiento DESC);
+-- Bandeja: paginación por (fecha_creacion, id); las pendientes usan índices parciales
+CREATE INDEX idx_notificaciones_fecha ON notificaciones(fecha_creacion DESC, id DESC);
+CREATE INDEX idx_notificaciones_pendientes ON notificaciones(fecha_creacion DESC, id DESC) WHERE leida = FALSE;
+-- Contador de pendientes por prioridad con un index-only scan
+CREATE INDEX idx_notificaciones_pendientes_prioridad ON notificaciones(prioridad) WHERE leida = FALSE;
+-- Deduplicación de alertas por clave (ver create_notificaciones en agent_service)
+CREATE INDEX idx_notificaciones_clave ON notificaciones(clave_dedup);
+CREATE INDEX idx_agent_runs_inicio ON agent_runs(inicio DESC);
+CREATE INDEX idx_agent_runs_agente ON agent_runs(agente, inicio DESC);
 
 -- DATOS DE PRUEBA --
 
@@ -191,3 +329,241 @@ BEGIN
     ('DESK-002', 'PC Lenovo ThinkCentre', 'Lenovo', 'M70q', 'SN30002', cat_desktop, prov_tec, ubic_lab101, 'disponible', '2023-03-20', '2026-03-20', 800.00);
 
 END $$;
+
+-- Vistas materializadas para los gráficos de reportes
+-- reportes_service las refresca con REFRESH MATERIALIZED VIEW CONCURRENTLY
+-- (requiere el índice único de cada vista). actualizado_en indica el "as of".
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_estado AS
+SELECT estado, COUNT(*) as cantidad, CURRENT_TIMESTAMP as actualizado_en
+FROM equipos
+GROUP BY estado;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_por_estado ON mv_equipos_por_estado(estado);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_categoria AS
+SELECT c.nombre, COUNT(e.id) as cantidad, COALESCE(SUM(e.costo_compra), 0) as valor_total,
+       CURRENT_TIMESTAMP as actualizado_en
+FROM categorias_equipos c
+LEFT JOIN equipos e ON c.id = e.categoria_id
+GROUP BY c.nombre;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_por_categoria ON mv_equipos_por_categoria(nombre);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_antiguedad AS
+SELECT 
+    CASE 
+        WHEN fecha_compra IS NULL THEN 'Desconocido'
+        WHEN DATE_PART('year', AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 'Menos de 1 año'
+        WHEN DATE_PART('year', AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 3 THEN '1-3 años'
+        WHEN DATE_PART('year', AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 5 THEN '3-5 años'
+        ELSE 'Más de 5 años'
+    END as rango,
+    COUNT(*) as cantidad,
+    CURRENT_TIMESTAMP as actualizado_en
+FROM equipos
+GROUP BY rango;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_antiguedad ON mv_equipos_antiguedad(rango);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_garantia AS
+SELECT 
+    CASE 
+        WHEN fecha_garantia_fin >= CURRENT_DATE THEN 'En Garantía'
+        ELSE 'Fuera de Garantía'
+    END as estado_garantia,
+    COUNT(*) as cantidad,
+    CURRENT_TIMESTAMP as actualizado_en
+FROM equipos
+WHERE fecha_garantia_fin IS NOT NULL
+GROUP BY estado_garantia;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_garantia ON mv_equipos_garantia(estado_garantia);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_mantenimientos_por_prioridad AS
+SELECT prioridad, COUNT(*) as cantidad, CURRENT_TIMESTAMP as actualizado_en
+FROM mantenimientos
+WHERE estado IN ('programado', 'en_proceso')
+GROUP BY prioridad;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_mantenimientos_por_prioridad ON mv_mantenimientos_por_prioridad(prioridad);
+
+-- Registro de cambios por tabla
+-- Cada sentencia que modifica una tabla agrega una fila; la versión de la tabla es la suma
+-- de `cambios` visible al leer, así que solo cuentan las transacciones confirmadas. Los
+-- escritores solo insertan y no compiten por una fila común. La caché de exportaciones de
+-- reportes_service usa estas versiones como parte de la clave: si no cambian, el archivo
+-- ya generado sigue siendo válido. compactar_cambios_tablas() (agent_service, a diario)
+-- reemplaza las filas de cada tabla por una sola con la suma.
+CREATE TABLE IF NOT EXISTS cambios_tablas (
+    id BIGSERIAL PRIMARY KEY,
+    tabla VARCHAR(100) NOT NULL,
+    cambios BIGINT NOT NULL DEFAULT 1,
+    fecha TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_cambios_tablas_tabla ON cambios_tablas(tabla) INCLUDE (cambios);
+
+CREATE OR REPLACE FUNCTION registrar_cambio_tabla() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO cambios_tablas (tabla) VALUES (TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Las filas insertadas por transacciones en curso no son visibles y no se borran, y la suma
+-- por tabla no cambia, así que se puede ejecutar en cualquier momento
+CREATE OR REPLACE FUNCTION compactar_cambios_tablas() RETURNS INTEGER AS $$
+DECLARE
+    filas INTEGER;
+BEGIN
+    WITH borradas AS (
+        DELETE FROM cambios_tablas RETURNING tabla, cambios
+    ), sumas AS (
+        INSERT INTO cambios_tablas (tabla, cambios)
+        SELECT tabla, SUM(cambios) FROM borradas GROUP BY tabla
+    )
+    SELECT COUNT(*) INTO filas FROM borradas;
+    RETURN filas;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['usuarios', 'categorias_equipos', 'proveedores', 'ubicaciones',
+                             'equipos', 'movimientos_equipos', 'mantenimientos'] LOOP
+        EXECUTE format(
+            'CREATE OR REPLACE TRIGGER trg_version_%1$s AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %1$I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION registrar_cambio_tabla()', t);
+    END LOOP;
+END $$;
+
+-- Hechos de costos de mantenimiento por día, equipo y tipo
+-- Los análisis de costos (dashboard, series de reportes, agente de costos) leen esta tabla
+-- en lugar de agregar mantenimientos completo. Se mantiene con el trigger de abajo; solo
+-- cuentan los mantenimientos con fecha_realizacion y costo.
+CREATE TABLE IF NOT EXISTS mantenimiento_costos_diarios (
+    fecha DATE NOT NULL,
+    equipo_id UUID,
+    tipo VARCHAR(50) NOT NULL,
+    costo_total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    cantidad INTEGER NOT NULL DEFAULT 0,
+    UNIQUE NULLS NOT DISTINCT (fecha, equipo_id, tipo)
+);
+CREATE INDEX IF NOT EXISTS idx_costos_diarios_equipo ON mantenimiento_costos_diarios(equipo_id);
+
+CREATE OR REPLACE FUNCTION actualizar_costos_diarios() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.fecha_realizacion IS NOT DISTINCT FROM OLD.fecha_realizacion
+       AND NEW.costo IS NOT DISTINCT FROM OLD.costo
+       AND NEW.tipo IS NOT DISTINCT FROM OLD.tipo
+       AND NEW.equipo_id IS NOT DISTINCT FROM OLD.equipo_id THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.fecha_realizacion IS NOT NULL AND OLD.costo IS NOT NULL THEN
+        UPDATE mantenimiento_costos_diarios
+        SET costo_total = costo_total - OLD.costo, cantidad = cantidad - 1
+        WHERE fecha = OLD.fecha_realizacion AND equipo_id IS NOT DISTINCT FROM OLD.equipo_id AND tipo = OLD.tipo;
+        DELETE FROM mantenimiento_costos_diarios
+        WHERE fecha = OLD.fecha_realizacion AND equipo_id IS NOT DISTINCT FROM OLD.equipo_id AND tipo = OLD.tipo
+        AND cantidad <= 0;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.fecha_realizacion IS NOT NULL AND NEW.costo IS NOT NULL THEN
+        INSERT INTO mantenimiento_costos_diarios (fecha, equipo_id, tipo, costo_total, cantidad)
+        VALUES (NEW.fecha_realizacion, NEW.equipo_id, NEW.tipo, NEW.costo, 1)
+        ON CONFLICT (fecha, equipo_id, tipo) DO UPDATE
+        SET costo_total = mantenimiento_costos_diarios.costo_total + EXCLUDED.costo_total,
+            cantidad = mantenimiento_costos_diarios.cantidad + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_mantenimientos_costos_diarios
+AFTER INSERT OR UPDATE OR DELETE ON mantenimientos
+FOR EACH ROW EXECUTE FUNCTION actualizar_costos_diarios();
+
+-- Carga inicial para bases existentes (no hace nada si la tabla ya tiene datos)
+INSERT INTO mantenimiento_costos_diarios (fecha, equipo_id, tipo, costo_total, cantidad)
+SELECT fecha_realizacion, equipo_id, tipo, SUM(costo), COUNT(*)
+FROM mantenimientos
+WHERE fecha_realizacion IS NOT NULL AND costo IS NOT NULL
+AND NOT EXISTS (SELECT 1 FROM mantenimiento_costos_diarios)
+GROUP BY fecha_realizacion, equipo_id, tipo;
+
+-- Fecha de fin de vida útil y marca de actualización de equipos
+-- Los agentes filtran por fecha_fin_vida_util (rango indexado) y fecha_actualizacion (escaneo incremental)
+CREATE OR REPLACE FUNCTION actualizar_equipo() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.fecha_fin_vida_util := (
+        SELECT (NEW.fecha_compra + make_interval(years => c.vida_util_anios))::date
+        FROM categorias_equipos c WHERE c.id = NEW.categoria_id
+    );
+    IF TG_OP = 'UPDATE' THEN
+        NEW.fecha_actualizacion := clock_timestamp();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_equipos_actualizar
+BEFORE INSERT OR UPDATE ON equipos
+FOR EACH ROW EXECUTE FUNCTION actualizar_equipo();
+
+-- Cambiar la vida útil de una categoría recalcula sus equipos (vía trg_equipos_actualizar)
+CREATE OR REPLACE FUNCTION propagar_vida_util() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE equipos SET fecha_fin_vida_util = NULL WHERE categoria_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_categorias_vida_util
+AFTER UPDATE OF vida_util_anios ON categorias_equipos
+FOR EACH ROW WHEN (NEW.vida_util_anios IS DISTINCT FROM OLD.vida_util_anios)
+EXECUTE FUNCTION propagar_vida_util();
+
+CREATE OR REPLACE FUNCTION marcar_actualizacion() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.fecha_actualizacion := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_mantenimientos_actualizacion
+BEFORE UPDATE ON mantenimientos
+FOR EACH ROW EXECUTE FUNCTION marcar_actualizacion();
+
+-- Carga inicial para bases existentes
+UPDATE equipos e SET fecha_fin_vida_util = (e.fecha_compra + make_interval(years => c.vida_util_anios))::date
+FROM categorias_equipos c
+WHERE e.categoria_id = c.id AND e.fecha_fin_vida_util IS NULL AND e.fecha_compra IS NOT NULL;
+
+-- Publicación de notificaciones nuevas y de cambios de mensaje o prioridad de las ya
+-- existentes (LISTEN notificaciones); los cambios llevan 'actualizada'. El agent_service
+-- las reenvía a los clientes conectados por SSE. NOTIFY admite menos de 8000 bytes, así
+-- que un mensaje muy largo se recorta y se omite datos_extra.
+CREATE OR REPLACE FUNCTION publicar_notificacion() RETURNS TRIGGER AS $$
+DECLARE
+    evento JSONB := jsonb_build_object(
+        'id', NEW.id, 'tipo', NEW.tipo, 'prioridad', NEW.prioridad, 'mensaje', NEW.mensaje,
+        'fecha_creacion', NEW.fecha_creacion, 'datos_extra', NEW.datos_extra,
+        'actualizada', TG_OP = 'UPDATE'
+    );
+BEGIN
+    IF octet_length(evento::text) > 7900 THEN
+        evento := evento - 'datos_extra' || jsonb_build_object('mensaje', left(NEW.mensaje, 1000), 'recortada', TRUE);
+    END IF;
+    PERFORM pg_notify('notificaciones', evento::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_notificaciones_publicar
+AFTER INSERT ON notificaciones
+FOR EACH ROW EXECUTE FUNCTION publicar_notificacion();
+
+CREATE OR REPLACE TRIGGER trg_notificaciones_publicar_cambio
+AFTER UPDATE OF mensaje, prioridad ON notificaciones
+FOR EACH ROW
+WHEN ((OLD.mensaje, OLD.prioridad) IS DISTINCT FROM (NEW.mensaje, NEW.prioridad))
+EXECUTE FUNCTION publicar_notificacion();
@@ -45,13 +45,22 @@ def get_dashboard_data():
 
 def get_notificaciones():
     try:
-        response = requests.get(f"{API_URL}/api/agents/notificaciones?leida=false")
+        response = requests.get(f"{API_URL}/api/agents/notificaciones?leida=false&limit=5")
         if response.status_code == 200:
             return response.json()
         return []
     except:
         return []
 
+def get_unread_count():
+    try:
+        response = requests.get(f"{API_URL}/api/agents/notificaciones/unread-count")
+        if response.status_code == 200:
+            return response.json().get('total', 0)
+        return 0
+    except:
+        return 0
+
 def run_agents():
     try:
         requests.post(f"{API_URL}/api/agents/run-all-agents")
@@ -78,7 +87,8 @@ with st.sidebar:
     if not notificaciones:
         st.info("No hay nuevas notificaciones")
     else:
-        for notif in notificaciones[:5]:
+        st.caption(f"{get_unread_count()} sin leer")
+        for notif in notificaciones:
             if isinstance(notif, dict):
                 icon = "🔴" if notif.get('prioridad') == 'alta' else "🔵"
                 st.warning(f"{icon} {notif.get('mensaje', '')}")
@@ -113,11 +113,36 @@ with tab3:
         
     params = {
         "fecha_inicio": str(f_start),
-        "fecha_fin": str(f_end)
+        "fecha_fin": str(f_end),
+        "limit": 200
     }
+
+    # Cursor stack for keyset pagination; reset when the filters change
+    filtros_key = (str(f_start), str(f_end))
+    if st.session_state.get("historial_filtros") != filtros_key:
+        st.session_state["historial_filtros"] = filtros_key
+        st.session_state["historial_cursores"] = [None]
+    cursores = st.session_state["historial_cursores"]
+    if cursores[-1]:
+        params["cursor"] = cursores[-1]
     
     try:
-        historial = requests.get(f"{API_URL}/api/mantenimientos/mantenimientos", params=params).json()
+        resp = requests.get(f"{API_URL}/api/mantenimientos/mantenimientos", params=params)
+        historial = resp.json()
+        next_cursor = resp.headers.get("X-Next-Cursor")
+
+        col_p1, col_p2, col_p3 = st.columns([1, 1, 4])
+        with col_p1:
+            if st.button("⬅️ Anterior", disabled=len(cursores) == 1):
+                cursores.pop()
+                st.rerun()
+        with col_p2:
+            if st.button("Siguiente ➡️", disabled=not next_cursor):
+                cursores.append(next_cursor)
+                st.rerun()
+        with col_p3:
+            st.caption(f"Página {len(cursores)}")
+
         if historial:
             df_h = pd.DataFrame(historial)
             st.dataframe(df_h, use_container_width=True, hide_index=True)
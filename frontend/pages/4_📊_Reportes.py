@@ -4,6 +4,7 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+import time
 import altair as alt
 
 API_URL = os.getenv("API_GATEWAY_URL", "http://api-gateway:8000")
@@ -22,6 +23,19 @@ def get_data(endpoint):
     except:
         return []
 
+def get_charts(charts):
+    # All charts in one request; the service computes them concurrently
+    try:
+        bundle = requests.get(f"{API_URL}/api/reportes/bundle", params={"charts": ",".join(charts)}).json()
+        return {name: chart.get('data') or [] for name, chart in bundle.get('charts', {}).items()}
+    except:
+        return {}
+
+charts = get_charts([
+    "equipos-por-estado", "equipos-por-ubicacion", "costos-mantenimiento",
+    "equipos-antiguedad", "mantenimientos-por-prioridad", "equipos-garantia"
+])
+
 with tab1:
     st.subheader("KPIs Principales")
     
@@ -38,14 +52,14 @@ with tab1:
     col_d1, col_d2 = st.columns(2)
     with col_d1:
         st.write("Equipos por Estado")
-        data_estado = get_data("equipos-por-estado")
+        data_estado = charts.get("equipos-por-estado")
         if data_estado:
             fig = px.pie(data_estado, values='cantidad', names='estado', hole=0.4)
             st.plotly_chart(fig, use_container_width=True)
             
     with col_d2:
         st.write("Equipos por Ubicación")
-        data_ubic = get_data("equipos-por-ubicacion")
+        data_ubic = charts.get("equipos-por-ubicacion")
         if data_ubic:
             fig = px.bar(data_ubic, x='nombre', y='cantidad')
             st.plotly_chart(fig, use_container_width=True)
@@ -57,7 +71,7 @@ with tab2:
     
     with col_g1:
         st.write("Costos de Mantenimiento por Mes")
-        data_costos = get_data("costos-mantenimiento")
+        data_costos = charts.get("costos-mantenimiento")
         if data_costos:
             df_costos = pd.DataFrame(data_costos)
             fig = px.line(df_costos, x='mes', y='total', color='tipo', markers=True)
@@ -65,7 +79,7 @@ with tab2:
             
     with col_g2:
         st.write("Antigüedad de Equipos")
-        data_antig = get_data("equipos-antiguedad")
+        data_antig = charts.get("equipos-antiguedad")
         if data_antig:
             fig = px.bar(data_antig, x='rango', y='cantidad')
             st.plotly_chart(fig, use_container_width=True)
@@ -74,14 +88,14 @@ with tab2:
     
     with col_g3:
         st.write("Mantenimientos por Prioridad")
-        data_prio = get_data("mantenimientos-por-prioridad")
+        data_prio = charts.get("mantenimientos-por-prioridad")
         if data_prio:
             fig = px.bar(data_prio, x='prioridad', y='cantidad', color='prioridad')
             st.plotly_chart(fig, use_container_width=True)
             
     with col_g4:
         st.write("Estado de Garantías")
-        data_garantia = get_data("equipos-garantia")
+        data_garantia = charts.get("equipos-garantia")
         if data_garantia:
             fig = px.pie(data_garantia, values='cantidad', names='estado_garantia')
             st.plotly_chart(fig, use_container_width=True)
@@ -91,40 +105,38 @@ with tab3:
     
     report_type = st.selectbox("Tipo de Reporte", ["inventario", "mantenimientos"])
     
+    def exportar(formato, label, mime, extension):
+        # Export runs as a background job on the server; poll until the file is ready
+        try:
+            job = requests.post(f"{API_URL}/api/reportes/export/jobs", json={"tipo_reporte": report_type, "formato": formato}).json()
+            progress = st.progress(0, text=f"Generando {label}...")
+            while job.get('estado') in ('pendiente', 'en_proceso'):
+                time.sleep(0.5)
+                job = requests.get(f"{API_URL}/api/reportes/export/jobs/{job['id']}").json()
+                progress.progress(job.get('progreso', 0), text=f"Generando {label}...")
+            progress.empty()
+
+            if job.get('estado') == 'completado':
+                resp = requests.get(f"{API_URL}/api/reportes/export/jobs/{job['id']}/download")
+                st.download_button(
+                    label=f"Descargar {label}",
+                    data=resp.content,
+                    file_name=f"reporte_{report_type}.{extension}",
+                    mime=mime
+                )
+            else:
+                st.error(f"Error al generar {label}: {job.get('error') or job.get('estado')}")
+        except:
+            st.error("Error de conexión")
+
     c1, c2 = st.columns(2)
     with c1:
         if st.button("📄 Exportar a PDF"):
-            with st.spinner("Generando PDF..."):
-                try:
-                    resp = requests.post(f"{API_URL}/api/reportes/export/pdf", json={"tipo_reporte": report_type})
-                    if resp.status_code == 200:
-                        st.download_button(
-                            label="Descargar PDF",
-                            data=resp.content,
-                            file_name=f"reporte_{report_type}.pdf",
-                            mime="application/pdf"
-                        )
-                    else:
-                        st.error("Error al generar PDF")
-                except:
-                    st.error("Error de conexión")
+            exportar("pdf", "PDF", "application/pdf", "pdf")
                     
     with c2:
         if st.button("📊 Exportar a Excel"):
-            with st.spinner("Generando Excel..."):
-                try:
-                    resp = requests.post(f"{API_URL}/api/reportes/export/excel", json={"tipo_reporte": report_type})
-                    if resp.status_code == 200:
-                        st.download_button(
-                            label="Descargar Excel",
-                            data=resp.content,
-                            file_name=f"reporte_{report_type}.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
-                    else:
-                        st.error("Error al generar Excel")
-                except:
-                    st.error("Error de conexión")
+            exportar("excel", "Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx")
 
 with tab4:
     st.subheader("Análisis Avanzado")
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+# Benchmark for the depreciation engine behind GET /depreciacion
+# (services/reportes_service/depreciacion.py). Builds a synthetic inventory with the
+# seed categories and 10 ubicaciones, projects book values for HORIZONTE months and
+# checks the result against a per-asset schedule computed in blocks. Some assets are
+# bought after the cutoff; check_future_purchases verifies they only count from their
+# purchase month.
+# Requires numpy.
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../services/reportes_service'))
+
+SIZES = [10_000, 100_000, 1_000_000]
+HORIZONTE = 60
+UBICACIONES = 10
+# (vida_util_anios, depreciacion_anual) of the seed categories
+CATEGORIAS = [(4, 25.00), (5, 20.00), (5, 20.00), (3, 33.33), (4, 25.00), (7, 14.28)]
+BLOCK = 50_000
+
+def per_asset(costo, edad, grupo, tasa_mensual, vida_meses, n_grupos, horizonte):
+    from depreciacion import valor_libros
+
+    resultado = np.zeros((n_grupos, horizonte + 1))
+    for inicio in range(0, len(costo), BLOCK):
+        s = slice(inicio, inicio + BLOCK)
+        g = grupo[s]
+        valores = valor_libros(costo[s], edad[s], tasa_mensual[g], vida_meses[g], horizonte)
+        for t in range(horizonte + 1):
+            resultado[:, t] += np.bincount(g, weights=valores[:, t], minlength=n_grupos)
+    return resultado
+
+def check_future_purchases():
+    from depreciacion import valor_libros
+
+    # Bought 3 months after the cutoff: nothing before then, full cost in that month
+    valores = valor_libros(np.array([1200.0]), np.array([-3]), np.array([0.01]), np.array([48.0]), 6)[0]
+    esperado = [0.0, 0.0, 0.0, 1200.0, 1188.0, 1176.0, 1164.0]
+    ok = np.allclose(valores, esperado)
+    print(f"Assets bought after the cutoff: match {ok}")
+    return ok
+
+def main():
+    from depreciacion import proyectar
+
+    if not check_future_purchases():
+        sys.exit(1)
+
+    rng = np.random.default_rng(0)
+    n_cat = len(CATEGORIAS)
+    tasa_mensual = np.repeat([tasa / 100 / 12 for _, tasa in CATEGORIAS], UBICACIONES)
+    vida_meses = np.repeat([vida * 12.0 for vida, _ in CATEGORIAS], UBICACIONES)
+
+    print(f"Depreciation engine benchmark ({HORIZONTE} months)")
+    for total in SIZES:
+        costo = rng.uniform(300, 15000, total).round(2)
+        edad = rng.integers(-12, 120, total)
+        grupo = rng.integers(0, n_cat, total) * UBICACIONES + rng.integers(0, UBICACIONES, total)
+
+        start = time.perf_counter()
+        resultado = proyectar(costo, edad, grupo, tasa_mensual, vida_meses, n_cat * UBICACIONES, HORIZONTE)
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        esperado = per_asset(costo, edad, grupo, tasa_mensual, vida_meses, n_cat * UBICACIONES, HORIZONTE)
+        elapsed_ref = time.perf_counter() - start
+
+        ok = np.allclose(resultado, esperado, rtol=1e-9)
+        print(f"{total:>10,} assets | engine {elapsed * 1000:8.1f} ms | per-asset {elapsed_ref * 1000:8.1f} ms | match {ok}")
+
+if __name__ == "__main__":
+    main()
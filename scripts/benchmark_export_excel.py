@@ -0,0 +1,53 @@
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+# Benchmark for the streaming Excel export (services/reportes_service/render.py).
+# Feeds synthetic rows, in the shape of the 'mantenimientos' report, through
+# ExcelStreamWriter in chunks and reports peak RSS per row count. Each size runs in
+# its own process so the peaks don't mask each other.
+# Requires the reportes_service dependencies (openpyxl, asyncpg, reportlab).
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../services/reportes_service'))
+
+SIZES = [10_000, 100_000, 1_000_000]
+CHUNK_SIZE = 5000
+
+def run_single(total_rows):
+    from render import ExcelStreamWriter
+
+    columns = ['fecha_programada', 'equipo', 'tipo', 'estado', 'costo']
+    inicio = date(2020, 1, 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = os.path.join(tmp, 'bench.xlsx')
+        start = time.perf_counter()
+        writer = ExcelStreamWriter(filepath, columns)
+        for offset in range(0, total_rows, CHUNK_SIZE):
+            chunk = [
+                (inicio + timedelta(days=i % 2000), f"Equipo {i % 3000}", 'preventivo', 'completado', Decimal('125.50'))
+                for i in range(offset, min(offset + CHUNK_SIZE, total_rows))
+            ]
+            writer.write(chunk)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        size_mb = os.path.getsize(filepath) / 1024 / 1024
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{total_rows:>10,} rows | {elapsed:7.1f} s | peak RSS {peak_mb:7.1f} MB | file {size_mb:6.1f} MB")
+
+def main():
+    if len(sys.argv) > 1:
+        run_single(int(sys.argv[1]))
+        return
+
+    print("Streaming Excel export benchmark")
+    for total_rows in SIZES:
+        subprocess.run([sys.executable, __file__, str(total_rows)], check=True)
+
+if __name__ == "__main__":
+    main()
@@ -45,8 +45,8 @@ def init_db():
         # Verify tables
         tables = [
             'usuarios', 'categorias_equipos', 'proveedores', 'ubicaciones', 
-            'equipos', 'movimientos_equipos', 'contratos', 'mantenimientos', 
-            'notificaciones'
+            'equipos', 'movimientos_equipos', 'contratos', 'planes_mantenimiento', 'mantenimientos', 
+            'notificaciones', 'agent_runs', 'agent_watermarks', 'agent_schedule', 'cambios_tablas', 'mantenimiento_costos_diarios'
         ]
         
         print("\nVerifying tables:")
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+# Minimal 5-field cron expressions (minute hour day-of-month month day-of-week) for the
+# agent scheduler. Each field accepts *, numbers, ranges (a-b), lists (a,b) and
+# steps (*/n, a-b/n). Day of week is 0-6 starting on Sunday; 7 is also Sunday.
+
+FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def parse_field(field: str, low: int, high: int):
+    values = set()
+    for part in field.split(','):
+        rango, _, paso = part.partition('/')
+        paso = int(paso) if paso else 1
+        if rango == '*':
+            inicio, fin = low, high
+        elif '-' in rango:
+            inicio, fin = (int(x) for x in rango.split('-', 1))
+        else:
+            inicio = fin = int(rango)
+        if not (low <= inicio <= fin <= high) or paso < 1:
+            raise ValueError(f"Invalid cron field '{field}'")
+        values.update(range(inicio, fin + 1, paso))
+    return values
+
+
+class Cron:
+    def __init__(self, expr: str):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: '{expr}'")
+        try:
+            self.minutes, self.hours, self.days, self.months, dows = (
+                parse_field(part, low, high) for part, (low, high) in zip(parts, FIELDS)
+            )
+        except ValueError as exc:
+            raise ValueError(f"Invalid cron expression '{expr}': {exc}")
+        self.dows = {d % 7 for d in dows}
+        self.expr = expr
+        # Like cron, when both day fields are restricted either one may match
+        self.any_day = parts[2] == '*' or parts[4] == '*'
+
+    def day_matches(self, t: datetime):
+        dom = t.day in self.days
+        dow = (t.weekday() + 1) % 7 in self.dows
+        return dom and dow if self.any_day else dom or dow
+
+    def next_after(self, after: datetime):
+        """First matching minute strictly after `after` (naive local time)."""
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = t + timedelta(days=366 * 5)
+        while t < limite:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression '{self.expr}' never matches")
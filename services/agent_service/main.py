@@ -1,8 +1,16 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import asyncpg
+import asyncio
+import base64
 import os
+import random
+import time
+import uuid
+from cron import Cron
+from reglas import REGLAS, compilar, notificacion
 from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
 import json
@@ -21,135 +29,468 @@ async def get_db_connection():
         port=os.getenv("POSTGRES_PORT")
     )
 
-async def create_notificacion(conn, tipo: str, mensaje: str, prioridad: str = "media", datos: dict = None):
-    await conn.execute("""
-        INSERT INTO notificaciones (tipo, mensaje, prioridad, datos_extra)
-        VALUES ($1, $2, $3, $4)
-    """, tipo, mensaje, prioridad, json.dumps(datos) if datos else None)
+# Agents run on pooled connections so a batch can run them all at once
+db_pool = None
+DB_POOL_SIZE = int(os.getenv("AGENT_DB_POOL_SIZE", "5"))
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT_SECONDS", "60"))
+# Keeps background batches referenced until they finish
+background_batches = set()
+
+@app.on_event("startup")
+async def startup_event():
+    global db_pool
+    db_pool = await asyncpg.create_pool(
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        database=os.getenv("POSTGRES_DB"),
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT"),
+        min_size=0,
+        max_size=DB_POOL_SIZE
+    )
+    if SCHEDULER_ENABLED:
+        for agente, cron in SCHEDULE.items():
+            scheduler_tasks.append(asyncio.create_task(schedule_loop(agente, cron)))
+    global listener_task
+    listener_task = asyncio.create_task(listen_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in scheduler_tasks + [listener_task]:
+        if task:
+            task.cancel()
+    if db_pool:
+        await db_pool.close()
+
+async def create_notificaciones(conn, notificaciones: list):
+    """Writes (clave_dedup, tipo, mensaje, prioridad, datos) tuples in a single statement.
+
+    clave_dedup identifies the alert (tipo, condition, entity and period). An unread
+    notification with the same key is updated only if its text or prioridad changed,
+    and a key already marked as read is not raised again. Returns the rows written.
+    """
+    por_clave = {n[0]: n for n in notificaciones}
+    if not por_clave:
+        return 0
+    claves, tipos, mensajes, prioridades, datos = zip(*por_clave.values())
+    # notificaciones is partitioned by month, so a unique index on clave_dedup alone is
+    # not possible; writers are serialized with a transaction-level advisory lock instead
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('notificaciones:clave_dedup'))")
+        return await conn.fetchval("""
+            WITH n AS (
+                SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::text[], $4::varchar[], $5::jsonb[])
+                    n(clave, tipo, mensaje, prioridad, datos)
+            ),
+            actualizadas AS (
+                UPDATE notificaciones p
+                SET mensaje = n.mensaje, prioridad = n.prioridad, datos_extra = n.datos
+                FROM n
+                WHERE p.clave_dedup = n.clave AND p.leida = FALSE
+                  AND (p.mensaje, p.prioridad) IS DISTINCT FROM (n.mensaje, n.prioridad)
+                RETURNING 1
+            ),
+            insertadas AS (
+                INSERT INTO notificaciones (clave_dedup, tipo, mensaje, prioridad, datos_extra, leida)
+                SELECT n.*, FALSE
+                FROM n
+                WHERE NOT EXISTS (SELECT 1 FROM notificaciones p WHERE p.clave_dedup = n.clave)
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM actualizadas) + (SELECT COUNT(*) FROM insertadas)
+        """, claves, tipos, mensajes, prioridades, [json.dumps(d) if d else None for d in datos])
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
-@app.post("/check-maintenance")
-async def check_maintenance():
+# Incremental scans: each rule keeps a watermark (DB clock at the start of its last
+# successful run, and that run's date). Later runs only evaluate rows modified after the
+# watermark, or whose date threshold was crossed since that date. The overlap re-reads
+# rows from transactions still open when the watermark was taken; notifications are
+# deduplicated, so re-reading them is harmless.
+WATERMARK_OVERLAP = timedelta(seconds=float(os.getenv("AGENT_WATERMARK_OVERLAP_SECONDS", "600")))
+
+def periodo(regla: dict, fecha: date):
+    if regla.get('periodo') == 'anio':
+        return fecha.year
+    if regla.get('periodo') == 'mes':
+        return fecha.year, fecha.month
+    if regla.get('periodo') == 'dia':
+        return fecha
+    return None
+
+async def evaluar_reglas(conn, reglas: list, dry_run: bool = False):
+    """Evaluates `reglas` with one query per base table (see reglas.compilar), the
+    tables concurrently, then writes the notifications and watermarks in one go.
+
+    Each rule keeps its own watermark under 'regla:<id>', so any subset of rules can
+    share a pass. With dry_run nothing is written: the result reports the matches per
+    rule, the keys that would be new and the planner's cost estimate per table.
+    """
+    today = date.today()
+    inicio = await conn.fetchval("SELECT clock_timestamp()")
+    previas = {
+        row['agente']: row for row in await conn.fetch(
+            "SELECT agente, marca, fecha FROM agent_watermarks WHERE agente = ANY($1::varchar[])",
+            [f"regla:{r['id']}" for r in reglas])
+    }
+    marcas = {}
+    for regla in reglas:
+        previa = previas.get(f"regla:{regla['id']}")
+        # A new period re-raises every alert (see clave) or refreshes the day counts in
+        # mensaje, so it needs a full scan
+        if previa and periodo(regla, previa['fecha']) == periodo(regla, today):
+            marcas[regla['id']] = (previa['marca'] - WATERMARK_OVERLAP, previa['fecha'])
+
+    contexto = {'hoy': today, 'anio': today.year, 'mes': f"{today:%Y-%m}"}
+    por_tabla = {}
+    for regla in reglas:
+        por_tabla.setdefault(regla['tabla'], []).append(regla)
+
+    resultado = {
+        r['id']: {"modo": "incremental" if r['id'] in marcas else "completo", "coincidencias": 0}
+        for r in reglas
+    }
+    async def pasada(conn, tabla, grupo):
+        query, params = compilar(tabla, grupo, marcas)
+        info = {}
+        if dry_run:
+            plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", today, *params))[0]['Plan']
+            info = {"costo_estimado": plan['Total Cost'], "filas_estimadas": plan['Plan Rows'], "sql": query}
+        return info, await conn.fetch(query, today, *params)
+
+    async def pasada_pool(tabla, grupo):
+        async with db_pool.acquire() as otra:
+            return await pasada(otra, tabla, grupo)
+
+    # The table passes run at once: the first on conn, the others on pooled connections
+    grupos = list(por_tabla.items())
+    pasadas = await asyncio.gather(*(
+        pasada(conn, tabla, grupo) if i == 0 else pasada_pool(tabla, grupo)
+        for i, (tabla, grupo) in enumerate(grupos)
+    ))
+
+    tablas, notificaciones = {}, []
+    for (tabla, grupo), (info, filas) in zip(grupos, pasadas):
+        tablas[tabla] = {**info, "filas": len(filas)}
+        for fila in filas:
+            valores = {**contexto, **dict(fila)}
+            for i in fila['reglas']:
+                n = notificacion(grupo[i], valores)
+                r = resultado[grupo[i]['id']]
+                r["coincidencias"] += 1
+                if dry_run and len(r.setdefault("ejemplos", [])) < 3:
+                    r["ejemplos"].append(n[2])
+                notificaciones.append(n)
+
+    filas = sum(t["filas"] for t in tablas.values())
+    if dry_run:
+        claves = list({n[0] for n in notificaciones})
+        nuevas = await conn.fetchval("""
+            SELECT COUNT(*) FROM unnest($1::varchar[]) k
+            WHERE NOT EXISTS (SELECT 1 FROM notificaciones WHERE clave_dedup = k)
+        """, claves)
+        return {
+            "message": "Dry run, nothing was written", "reglas": resultado, "tablas": tablas,
+            "filas": filas, "notificaciones": len(claves), "nuevas": nuevas
+        }
+
+    escritas = await create_notificaciones(conn, notificaciones)
+    await conn.execute("""
+        INSERT INTO agent_watermarks (agente, marca, fecha)
+        SELECT agente, $2, $3 FROM unnest($1::varchar[]) agente
+        ON CONFLICT (agente) DO UPDATE SET marca = EXCLUDED.marca, fecha = EXCLUDED.fecha
+    """, [f"regla:{r['id']}" for r in reglas], inicio, today)
+    return {
+        "message": "Rules evaluated", "reglas": resultado, "tablas": tablas,
+        "filas": filas, "notificaciones": escritas
+    }
+
+def rules_agent(agente: str = None):
+    reglas = [r for r in REGLAS if agente is None or r['agente'] == agente]
+
+    async def run(conn):
+        return await evaluar_reglas(conn, reglas)
+    return run
+
+@app.delete("/agent-watermarks")
+async def reset_agent_watermarks(agente: Optional[str] = None):
+    """Forgets the watermarks so the next run is a full scan (e.g. after a bulk load
+    that bypassed the triggers). `agente` may be an agent or a rule id."""
     conn = await get_db_connection()
     try:
-        today = date.today()
-        
-        # 1. Check upcoming maintenance (7 days)
-        upcoming = await conn.fetch("""
-            SELECT m.*, e.nombre as equipo 
-            FROM mantenimientos m
-            JOIN equipos e ON m.equipo_id = e.id
-            WHERE m.fecha_programada BETWEEN $1 AND $2
-            AND m.estado = 'programado'
-        """, today, today + timedelta(days=7))
-        
-        for m in upcoming:
-            days = (m['fecha_programada'] - today).days
-            msg = f"Mantenimiento próximo para {m['equipo']} en {days} días."
-            await create_notificacion(conn, 'mantenimiento', msg, 'media', {'mantenimiento_id': str(m['id'])})
-
-        # 2. Check overdue maintenance
-        overdue = await conn.fetch("""
-            SELECT m.*, e.nombre as equipo 
-            FROM mantenimientos m
-            JOIN equipos e ON m.equipo_id = e.id
-            WHERE m.fecha_programada < $1
-            AND m.estado = 'programado'
-        """, today)
-        
-        for m in overdue:
-            msg = f"URGENTE: Mantenimiento vencido para {m['equipo']}."
-            await create_notificacion(conn, 'mantenimiento', msg, 'alta', {'mantenimiento_id': str(m['id'])})
-            
-        return {"message": "Maintenance check completed", "upcoming": len(upcoming), "overdue": len(overdue)}
+        if agente:
+            claves = [f"regla:{r['id']}" for r in REGLAS if agente in (r['agente'], r['id'])]
+            await conn.execute("DELETE FROM agent_watermarks WHERE agente = ANY($1::varchar[])", claves)
+        else:
+            await conn.execute("DELETE FROM agent_watermarks")
+        return {"message": "Agent watermarks reset"}
     finally:
         await conn.close()
 
+# Each agent endpoint evaluates its own rules; evaluate-rules runs all of them in one
+# pass per table and is what /run-all-agents uses
+AGENTS = {agente: rules_agent(agente) for agente in dict.fromkeys(r['agente'] for r in REGLAS)}
+AGENTS['evaluate-rules'] = rules_agent()
+
+# Monthly partitions: months created ahead, and months kept before a partition is
+# archived (moved to the archivo schema) or dropped. Notification partitions that still
+# hold unread rows are kept.
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+RETENTION = {
+    'notificaciones': (
+        int(os.getenv("NOTIFICACIONES_RETENTION_MONTHS", "6")),
+        os.getenv("NOTIFICACIONES_RETENTION_MODE", "archive"),
+    ),
+    'movimientos_equipos': (
+        int(os.getenv("MOVIMIENTOS_RETENTION_MONTHS", "36")),
+        os.getenv("MOVIMIENTOS_RETENTION_MODE", "archive"),
+    ),
+}
+
+async def partition_maintenance_job(conn):
+    hoy = date.today().replace(day=1)
+    creadas, archivadas, eliminadas = 0, [], []
+    for tabla, (meses, modo) in RETENTION.items():
+        creadas += await conn.fetchval(
+            "SELECT crear_particiones_mensuales($1, $2, $3)", tabla, hoy, PARTITION_MONTHS_AHEAD + 1)
+
+        limite = hoy
+        for _ in range(meses):
+            limite = (limite - timedelta(days=1)).replace(day=1)
+        particiones = await conn.fetch("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = $1::regclass AND c.relname ~ '_[0-9]{4}_[0-9]{2}$'
+            ORDER BY c.relname
+        """, tabla)
+        for p in particiones:
+            nombre = p['relname']
+            if date(int(nombre[-7:-3]), int(nombre[-2:]), 1) >= limite:
+                break
+            if tabla == 'notificaciones' and await conn.fetchval(
+                    f'SELECT EXISTS (SELECT 1 FROM "{nombre}" WHERE leida = FALSE)'):
+                continue
+            async with conn.transaction():
+                # DETACH locks the parent; give up instead of queueing behind long queries
+                await conn.execute("SET LOCAL lock_timeout = '5s'")
+                await conn.execute(f'ALTER TABLE "{tabla}" DETACH PARTITION "{nombre}"')
+                if modo == 'drop':
+                    await conn.execute(f'DROP TABLE "{nombre}"')
+                    eliminadas.append(nombre)
+                else:
+                    await conn.execute(f'ALTER TABLE "{nombre}" SET SCHEMA archivo')
+                    archivadas.append(nombre)
+                # DETACH removes rows without firing the statement triggers; record the
+                # change so exports cached over this table are not served again
+                await conn.execute("INSERT INTO cambios_tablas (tabla) VALUES ($1)", tabla)
+    return {
+        "message": "Partition maintenance completed",
+        "filas": creadas + len(archivadas) + len(eliminadas), "notificaciones": 0,
+        "creadas": creadas, "archivadas": archivadas, "eliminadas": eliminadas
+    }
+
+async def compact_table_changes_job(conn):
+    filas = await conn.fetchval("SELECT compactar_cambios_tablas()")
+    return {"message": "Table change log compacted", "filas": filas, "notificaciones": 0}
+
+# Maintenance jobs share the runner and the scheduler but are not part of /run-all-agents
+JOBS = {
+    'partition-maintenance': partition_maintenance_job,
+    'compact-table-changes': compact_table_changes_job,
+}
+TASKS = {**AGENTS, **JOBS}
+
+async def run_agent(agente: str, lote_id: str = None):
+    """Runs one agent on a pooled connection under AGENT_TIMEOUT and records the run
+    in agent_runs. Returns (result, error)."""
+    inicio = datetime.now().astimezone()
+    start = time.perf_counter()
+    result, error = None, None
+    try:
+        async with db_pool.acquire() as conn:
+            result = await asyncio.wait_for(TASKS[agente](conn), AGENT_TIMEOUT)
+    except asyncio.TimeoutError:
+        error = f"Timed out after {AGENT_TIMEOUT:g}s"
+    except Exception as exc:
+        error = str(exc) or type(exc).__name__
+    duracion_ms = int((time.perf_counter() - start) * 1000)
+
+    try:
+        async with db_pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO agent_runs (lote_id, agente, inicio, duracion_ms, filas, notificaciones, error)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+            """, lote_id, agente, inicio, duracion_ms,
+                result['filas'] if result else None, result['notificaciones'] if result else None, error)
+    except Exception as exc:
+        print(f"Error recording run of {agente}: {exc}")
+    return result, error
+
+async def agent_response(agente: str):
+    result, error = await run_agent(agente)
+    if error:
+        raise HTTPException(status_code=500, detail=error)
+    return result
+
+@app.post("/check-maintenance")
+async def check_maintenance():
+    return await agent_response('check-maintenance')
+
 @app.post("/check-obsolescence")
 async def check_obsolescence():
-    conn = await get_db_connection()
-    try:
-        # Check equipments older than useful life
-        obsolete = await conn.fetch("""
-            SELECT e.id, e.nombre, e.fecha_compra, c.vida_util_anios
-            FROM equipos e
-            JOIN categorias_equipos c ON e.categoria_id = c.id
-            WHERE e.fecha_compra IS NOT NULL
-            AND (e.fecha_compra + (c.vida_util_anios || ' years')::interval) < CURRENT_DATE
-            AND e.estado != 'baja'
-        """)
-        
-        for e in obsolete:
-            msg = f"Obsolescencia: El equipo {e['nombre']} ha superado su vida útil."
-            await create_notificacion(conn, 'obsolescencia', msg, 'media', {'equipo_id': str(e['id'])})
-            
-        return {"message": "Obsolescence check completed", "count": len(obsolete)}
-    finally:
-        await conn.close()
+    return await agent_response('check-obsolescence')
 
 @app.post("/check-warranties")
 async def check_warranties():
-    conn = await get_db_connection()
-    try:
-        today = date.today()
-        # Check warranties expiring in 60 days
-        expiring = await conn.fetch("""
-            SELECT e.id, e.nombre, e.fecha_garantia_fin
-            FROM equipos e
-            WHERE e.fecha_garantia_fin BETWEEN $1 AND $2
-        """, today, today + timedelta(days=60))
-        
-        for e in expiring:
-            days = (e['fecha_garantia_fin'] - today).days
-            msg = f"Garantía por vencer: {e['nombre']} expira en {days} días."
-            await create_notificacion(conn, 'garantia', msg, 'media', {'equipo_id': str(e['id'])})
-            
-        return {"message": "Warranty check completed", "count": len(expiring)}
-    finally:
-        await conn.close()
+    return await agent_response('check-warranties')
+
+@app.post("/evaluate-rules")
+async def evaluate_rules():
+    return await agent_response('evaluate-rules')
+
+@app.get("/rules")
+async def get_rules():
+    return REGLAS
+
+@app.post("/rules/dry-run")
+async def rules_dry_run(agente: Optional[str] = None, regla: Optional[str] = None):
+    reglas = [r for r in REGLAS if (agente is None or r['agente'] == agente) and (regla is None or r['id'] == regla)]
+    if not reglas:
+        raise HTTPException(status_code=404, detail="No rules match")
+    async with db_pool.acquire() as conn:
+        return await evaluar_reglas(conn, reglas, dry_run=True)
+
+@app.post("/partition-maintenance")
+async def partition_maintenance():
+    return await agent_response('partition-maintenance')
+
+@app.post("/compact-table-changes")
+async def compact_table_changes():
+    return await agent_response('compact-table-changes')
 
 @app.post("/analyze-maintenance-costs")
 async def analyze_maintenance_costs():
+    return await agent_response('analyze-maintenance-costs')
+
+@app.get("/agent-runs")
+async def get_agent_runs(
+    agente: Optional[str] = None,
+    lote_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500)
+):
     conn = await get_db_connection()
     try:
-        # Check equipments with high maintenance costs (> 50% of purchase cost)
-        high_cost = await conn.fetch("""
-            SELECT e.id, e.nombre, e.costo_compra, SUM(m.costo) as total_mantenimiento
-            FROM equipos e
-            JOIN mantenimientos m ON e.id = m.equipo_id
-            WHERE e.costo_compra > 0
-            GROUP BY e.id, e.nombre, e.costo_compra
-            HAVING SUM(m.costo) > (e.costo_compra * 0.5)
-        """)
-        
-        for e in high_cost:
-            msg = f"Alto Costo: Mantenimiento de {e['nombre']} supera el 50% de su valor."
-            await create_notificacion(conn, 'sistema', msg, 'alta', {'equipo_id': str(e['id'])})
-            
-        return {"message": "Cost analysis completed", "count": len(high_cost)}
+        query = "SELECT * FROM agent_runs WHERE 1=1"
+        params = []
+        if agente:
+            params.append(agente)
+            query += f" AND agente = ${len(params)}"
+        if lote_id:
+            params.append(lote_id)
+            query += f" AND lote_id = ${len(params)}::uuid"
+        params.append(limit)
+        query += f" ORDER BY inicio DESC LIMIT ${len(params)}"
+
+        rows = await conn.fetch(query, *params)
+        return [dict(row) for row in rows]
     finally:
         await conn.close()
 
+def encode_cursor(fecha: datetime, id) -> str:
+    payload = json.dumps({"v": fecha.isoformat(), "id": str(id)})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(payload["v"]), uuid.UUID(payload["id"])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/notificaciones")
-async def get_notificaciones(leida: Optional[bool] = False):
+async def get_notificaciones(
+    response: Response,
+    leida: Optional[bool] = False,
+    tipo: Optional[str] = None,
+    prioridad: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None
+):
+    # Keyset pagination on (fecha_creacion, id), newest first; next cursor in X-Next-Cursor
     conn = await get_db_connection()
     try:
         query = "SELECT * FROM notificaciones WHERE 1=1"
         params = []
         if leida is not None:
-            query += " AND leida = $1"
             params.append(leida)
-            
-        query += " ORDER BY fecha_creacion DESC LIMIT 50"
-        
+            query += f" AND leida = ${len(params)}"
+        if tipo:
+            params.append(tipo)
+            query += f" AND tipo = ${len(params)}"
+        if prioridad:
+            params.append(prioridad)
+            query += f" AND prioridad = ${len(params)}"
+        if cursor:
+            cursor_fecha, cursor_id = decode_cursor(cursor)
+            query += f" AND (fecha_creacion, id) < (${len(params) + 1}, ${len(params) + 2}::uuid)"
+            params.extend([cursor_fecha, cursor_id])
+        params.append(limit + 1)
+        query += f" ORDER BY fecha_creacion DESC, id DESC LIMIT ${len(params)}"
+
         rows = await conn.fetch(query, *params)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]['fecha_creacion'], rows[-1]['id'])
         return [dict(row) for row in rows]
     finally:
         await conn.close()
 
+@app.get("/notificaciones/unread-count")
+async def get_unread_count():
+    # Index-only scan over idx_notificaciones_pendientes_prioridad
+    conn = await get_db_connection()
+    try:
+        rows = await conn.fetch("""
+            SELECT prioridad, COUNT(*) as total
+            FROM notificaciones
+            WHERE leida = FALSE
+            GROUP BY prioridad
+        """)
+        return {
+            "total": sum(row['total'] for row in rows),
+            "por_prioridad": {row['prioridad']: row['total'] for row in rows},
+        }
+    finally:
+        await conn.close()
+
+class MarcarLeidas(BaseModel):
+    ids: Optional[List[str]] = None
+    antes_de: Optional[datetime] = None
+    tipo: Optional[str] = None
+
+@app.put("/notificaciones/marcar-leidas")
+async def marcar_leidas(body: MarcarLeidas):
+    if body.ids is None and body.antes_de is None:
+        raise HTTPException(status_code=400, detail="Provide ids or antes_de")
+    conn = await get_db_connection()
+    try:
+        # Either list may be combined with tipo; everything is updated in one statement
+        result = await conn.execute("""
+            UPDATE notificaciones SET leida = TRUE
+            WHERE leida = FALSE
+              AND ($1::uuid[] IS NULL OR id = ANY($1::uuid[]))
+              AND ($2::timestamptz IS NULL OR fecha_creacion <= $2)
+              AND ($3::varchar IS NULL OR tipo = $3)
+        """, body.ids, body.antes_de, body.tipo)
+        return {"message": "Notifications marked as read", "actualizadas": int(result.split()[-1])}
+    except asyncpg.DataError:
+        raise HTTPException(status_code=400, detail="Invalid notification id")
+    finally:
+        await conn.close()
+
 @app.put("/notificaciones/{id}/marcar-leida")
 async def marcar_leida(id: str):
     conn = await get_db_connection()
@@ -159,10 +500,265 @@ async def marcar_leida(id: str):
     finally:
         await conn.close()
 
+# Push delivery: one LISTEN connection per replica fans new notifications out to the
+# SSE clients connected to it. Each client has a bounded queue; when a slow client's
+# queue is full further events are dropped for it and counted, and the client gets a
+# `resync` event so it reloads the inbox instead of holding the publisher back.
+STREAM_QUEUE_SIZE = int(os.getenv("NOTIFICATION_STREAM_QUEUE_SIZE", "100"))
+STREAM_HEARTBEAT = float(os.getenv("NOTIFICATION_STREAM_HEARTBEAT_SECONDS", "15"))
+STREAM_REPLAY_LIMIT = 200
+# fecha_creacion is the start of the inserting transaction, so a row can commit after
+# rows with a later fecha_creacion were delivered. The replay reaches back this far
+# before the client's last event to pick those up; clients dedupe by id.
+STREAM_REPLAY_OVERLAP = timedelta(seconds=float(os.getenv("NOTIFICATION_STREAM_REPLAY_OVERLAP_SECONDS", "60")))
+suscripciones = set()
+listener_task = None
+
+class Suscripcion:
+    def __init__(self, tipos: set, prioridades: set):
+        self.tipos = tipos
+        self.prioridades = prioridades
+        self.cola = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        # Events this client missed (None: unknown, e.g. the listener reconnected)
+        self.perdidas = 0
+
+    def publicar(self, evento: dict):
+        if self.tipos and evento['tipo'] not in self.tipos:
+            return
+        if self.prioridades and evento['prioridad'] not in self.prioridades:
+            return
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            if self.perdidas is not None:
+                self.perdidas += 1
+
+def on_notificacion(conn, pid, channel, payload):
+    evento = json.loads(payload)
+    for suscripcion in list(suscripciones):
+        suscripcion.publicar(evento)
+
+async def listen_loop():
+    primera = True
+    while True:
+        cerrada = asyncio.Event()
+        try:
+            conn = await get_db_connection()
+            try:
+                conn.add_termination_listener(lambda c: cerrada.set())
+                await conn.add_listener('notificaciones', on_notificacion)
+                if not primera:
+                    # Anything published while disconnected was lost
+                    for suscripcion in suscripciones:
+                        suscripcion.perdidas = None
+                primera = False
+                await cerrada.wait()
+            finally:
+                await conn.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            print(f"Error in notification listener: {exc}")
+        await asyncio.sleep(5)
+
+def sse(evento: str, data, id: str = None):
+    lines = [f"id: {id}"] if id else []
+    lines += [f"event: {evento}", f"data: {json.dumps(data, default=str)}"]
+    return "\n".join(lines) + "\n\n"
+
+def notificacion_event(n: dict):
+    if n.get('actualizada'):
+        # No id: an update of an old notification must not move the client's
+        # Last-Event-ID back
+        return sse("notificacion", n)
+    fecha = n['fecha_creacion']
+    if isinstance(fecha, str):
+        fecha = datetime.fromisoformat(fecha)
+    return sse("notificacion", n, encode_cursor(fecha, n['id']))
+
+@app.get("/notificaciones/stream")
+async def notificaciones_stream(
+    request: Request,
+    tipo: Optional[str] = None,
+    prioridad: Optional[str] = None
+):
+    """Server-sent events with each new notification, and with changes to the mensaje
+    or prioridad of existing ones (`actualizada`). `tipo` and `prioridad` take
+    comma-separated values. A client reconnecting with Last-Event-ID first receives
+    the unread notifications it missed; changes to older notifications made while it
+    was disconnected are not replayed."""
+    tipos = set(tipo.split(',')) if tipo else set()
+    prioridades = set(prioridad.split(',')) if prioridad else set()
+    ultimo = request.headers.get("last-event-id")
+    desde = decode_cursor(ultimo) if ultimo else None
+
+    # Subscribe before replaying so nothing falls in between; clients dedupe by id
+    suscripcion = Suscripcion(tipos, prioridades)
+    suscripciones.add(suscripcion)
+
+    async def eventos():
+        try:
+            if desde:
+                conn = await get_db_connection()
+                try:
+                    perdidas = await conn.fetch("""
+                        SELECT id, tipo, prioridad, mensaje, fecha_creacion, datos_extra
+                        FROM notificaciones
+                        WHERE leida = FALSE AND fecha_creacion > $1 AND id <> $2::uuid
+                          AND (cardinality($3::varchar[]) = 0 OR tipo = ANY($3))
+                          AND (cardinality($4::varchar[]) = 0 OR prioridad = ANY($4))
+                        ORDER BY fecha_creacion, id
+                        LIMIT $5
+                    """, desde[0] - STREAM_REPLAY_OVERLAP, desde[1], list(tipos), list(prioridades),
+                        STREAM_REPLAY_LIMIT + 1)
+                finally:
+                    await conn.close()
+                if len(perdidas) > STREAM_REPLAY_LIMIT:
+                    yield sse("resync", {"perdidas": None})
+                else:
+                    for row in perdidas:
+                        yield notificacion_event(dict(row))
+            while True:
+                if suscripcion.perdidas != 0:
+                    yield sse("resync", {"perdidas": suscripcion.perdidas})
+                    suscripcion.perdidas = 0
+                try:
+                    evento = await asyncio.wait_for(suscripcion.cola.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    yield ": ping\n\n"
+                    continue
+                yield notificacion_event(evento)
+        finally:
+            suscripciones.discard(suscripcion)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def run_agents_batch(lote_id: str):
+    result, error = await run_agent('evaluate-rules', lote_id)
+    return result if error is None else {"error": error}
+
 @app.post("/run-all-agents")
-async def run_all_agents(background_tasks: BackgroundTasks):
-    background_tasks.add_task(check_maintenance)
-    background_tasks.add_task(check_obsolescence)
-    background_tasks.add_task(check_warranties)
-    background_tasks.add_task(analyze_maintenance_costs)
-    return {"message": "All agents started in background"}
+async def run_all_agents(esperar: bool = False):
+    # All rules in one pass per table; the run is recorded in agent_runs under lote_id
+    lote_id = str(uuid.uuid4())
+    if esperar:
+        return {"lote_id": lote_id, "resultados": await run_agents_batch(lote_id)}
+    task = asyncio.create_task(run_agents_batch(lote_id))
+    background_batches.add(task)
+    task.add_done_callback(background_batches.discard)
+    return {"message": "All agents started in background", "lote_id": lote_id}
+
+# Scheduler: every replica runs the same loops, and a per-agent advisory lock plus the
+# last slot stored in agent_schedule make sure each slot runs on exactly one of them.
+DEFAULT_SCHEDULE = {
+    'check-maintenance': '0 * * * *',
+    'evaluate-rules': '0 6 * * *',
+    'partition-maintenance': '15 3 * * *',
+    'compact-table-changes': '45 3 * * *',
+}
+# AGENT_SCHEDULE='{"check-maintenance": "*/30 * * * *"}' overrides entries; "" disables one
+SCHEDULE = {
+    agente: Cron(expr)
+    for agente, expr in {**DEFAULT_SCHEDULE, **json.loads(os.getenv("AGENT_SCHEDULE") or "{}")}.items()
+    if expr
+}
+SCHEDULER_ENABLED = os.getenv("AGENT_SCHEDULER_ENABLED", "true").lower() == "true"
+SCHEDULE_JITTER = float(os.getenv("AGENT_SCHEDULE_JITTER_SECONDS", "30"))
+scheduler_tasks = []
+
+def to_local(value: datetime):
+    return value.astimezone().replace(tzinfo=None) if value else None
+
+async def ultima_programada(agente: str):
+    conn = await get_db_connection()
+    try:
+        return to_local(await conn.fetchval("SELECT ultima_programada FROM agent_schedule WHERE agente = $1", agente))
+    finally:
+        await conn.close()
+
+async def run_scheduled(agente: str, slot: datetime):
+    """Runs `agente` for `slot` unless another replica holds its lock or already ran it."""
+    conn = await get_db_connection()
+    try:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", f"agent_schedule:{agente}"):
+            return False
+        try:
+            ultima = to_local(await conn.fetchval("SELECT ultima_programada FROM agent_schedule WHERE agente = $1", agente))
+            if ultima and ultima >= slot:
+                return False
+            # A failed run still consumes its slot; the error is kept in agent_runs
+            await run_agent(agente)
+            await conn.execute("""
+                INSERT INTO agent_schedule (agente, ultima_programada) VALUES ($1, $2)
+                ON CONFLICT (agente) DO UPDATE SET ultima_programada = EXCLUDED.ultima_programada
+            """, agente, slot.astimezone())
+            return True
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", f"agent_schedule:{agente}")
+    finally:
+        await conn.close()
+
+async def schedule_loop(agente: str, cron: Cron):
+    atendida = None
+    while True:
+        try:
+            ultima = await ultima_programada(agente)
+            base = max(filter(None, [ultima, atendida]), default=None)
+            ahora = datetime.now()
+            slot = cron.next_after(base or ahora)
+            if slot <= ahora:
+                # Slots missed while no replica was up: run once, for the most recent one
+                while (siguiente := cron.next_after(slot)) <= ahora:
+                    slot = siguiente
+            else:
+                await asyncio.sleep((slot - ahora).total_seconds())
+            # Jitter spreads replicas and agents that share a slot
+            await asyncio.sleep(random.uniform(0, SCHEDULE_JITTER))
+            await run_scheduled(agente, slot)
+            atendida = slot
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            print(f"Error in scheduler for {agente}: {exc}")
+            await asyncio.sleep(60)
+
+@app.get("/schedule")
+async def get_schedule():
+    conn = await get_db_connection()
+    try:
+        ultimas = {
+            row['agente']: to_local(row['ultima_programada'])
+            for row in await conn.fetch("SELECT agente, ultima_programada FROM agent_schedule")
+        }
+        runs = {
+            row['agente']: dict(row)
+            for row in await conn.fetch("""
+                SELECT DISTINCT ON (agente) agente, inicio, duracion_ms, filas, notificaciones, error
+                FROM agent_runs
+                ORDER BY agente, inicio DESC
+            """)
+        }
+    finally:
+        await conn.close()
+
+    ahora = datetime.now()
+    result = []
+    for agente, cron in SCHEDULE.items():
+        ultima = ultimas.get(agente)
+        proxima = cron.next_after(ultima or ahora) if SCHEDULER_ENABLED else None
+        result.append({
+            "agente": agente,
+            "cron": cron.expr,
+            "habilitado": SCHEDULER_ENABLED,
+            # A slot in the past is a pending catch-up run
+            "proxima": max(proxima, ahora) if proxima else None,
+            "ultima_programada": ultima,
+            "ultima_ejecucion": runs.get(agente),
+        })
+    return result
+
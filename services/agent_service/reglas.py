@@ -0,0 +1,230 @@
+import re
+
+# Declarative agent checks. Each rule belongs to a base table; agent_service compiles
+# every rule of a table into one query (see compilar), so all checks over that table
+# are evaluated in a single scan. Adding a check means adding an entry to REGLAS.
+#
+# Rule fields:
+#   id          unique name, also the rule's watermark key
+#   agente      legacy agent endpoint that runs it (/check-maintenance, ...)
+#   tabla       base table, a key of BASES
+#   condicion   SQL condition over the base columns
+#   cruce       optional SQL date: first day the condition can hold without the row
+#               changing (e.g. the day a maintenance enters the 7-day window)
+#   cambio      optional SQL condition: inputs outside the base row changed
+#   uniones     optional aliases of the base's uniones the rule's SQL reads
+#   periodo     'dia', 'mes' or 'anio': the first run of each period is a full scan.
+#               Needed when clave includes the period, or mensaje changes with :hoy
+#               (a day count) for rows that are neither changed nor crossing cruce
+#   tipo, prioridad, mensaje, clave, datos
+#               notification fields; mensaje, clave and datos values are format
+#               templates over the base columns plus hoy, anio and mes
+#
+# SQL fragments may use :hoy (run date). cambio may also use :marca (DB clock at the
+# start of the rule's last run) and :previa (date of that run), which only exist when
+# the rule is evaluated incrementally.
+#
+# Base uniones are aggregates LEFT JOINed on the base id, only for the rules listing
+# them. When every such rule is incremental, the aggregate is restricted ({filtro}) to
+# the rows their incremental filters can select.
+
+BASES = {
+    'mantenimientos': {
+        'desde': "mantenimientos m JOIN equipos e ON m.equipo_id = e.id",
+        'actualizacion': "m.fecha_actualizacion",
+        'columnas': {
+            'id': "m.id",
+            'fecha_programada': "m.fecha_programada",
+            'equipo': "e.nombre",
+            'dias': "m.fecha_programada - :hoy",
+        },
+    },
+    'equipos': {
+        'desde': "equipos e",
+        'actualizacion': "e.fecha_actualizacion",
+        'uniones': {
+            'c': {
+                'sql': """
+                    SELECT equipo_id, SUM(costo_total) as total_mantenimiento
+                    FROM mantenimiento_costos_diarios
+                    {filtro}
+                    GROUP BY equipo_id""",
+                'clave': "equipo_id",
+            },
+        },
+        'columnas': {
+            'id': "e.id",
+            'nombre': "e.nombre",
+            'fecha_garantia_fin': "e.fecha_garantia_fin",
+            'dias_garantia': "e.fecha_garantia_fin - :hoy",
+        },
+    },
+}
+
+REGLAS = [
+    {
+        'id': 'mantenimiento_proximo',
+        'agente': 'check-maintenance',
+        'tabla': 'mantenimientos',
+        'condicion': "m.estado = 'programado' AND m.fecha_programada BETWEEN :hoy AND :hoy + 7",
+        'cruce': "m.fecha_programada - 7",
+        # The day count in mensaje changes daily
+        'periodo': 'dia',
+        'tipo': 'mantenimiento',
+        'prioridad': 'media',
+        'mensaje': "Mantenimiento próximo para {equipo} en {dias} días.",
+        'clave': "mantenimiento:proximo:{id}:{fecha_programada}",
+        'datos': {'mantenimiento_id': "{id}"},
+    },
+    {
+        'id': 'mantenimiento_vencido',
+        'agente': 'check-maintenance',
+        'tabla': 'mantenimientos',
+        'condicion': "m.estado = 'programado' AND m.fecha_programada < :hoy",
+        'cruce': "m.fecha_programada + 1",
+        'tipo': 'mantenimiento',
+        'prioridad': 'alta',
+        'mensaje': "URGENTE: Mantenimiento vencido para {equipo}.",
+        'clave': "mantenimiento:vencido:{id}:{fecha_programada}",
+        'datos': {'mantenimiento_id': "{id}"},
+    },
+    {
+        'id': 'obsolescencia_vida_util',
+        'agente': 'check-obsolescence',
+        'tabla': 'equipos',
+        'condicion': "e.estado != 'baja' AND e.fecha_fin_vida_util < :hoy",
+        'cruce': "e.fecha_fin_vida_util + 1",
+        # Once read, the alert comes back the following year
+        'periodo': 'anio',
+        'tipo': 'obsolescencia',
+        'prioridad': 'media',
+        'mensaje': "Obsolescencia: El equipo {nombre} ha superado su vida útil.",
+        'clave': "obsolescencia:vida_util:{id}:{anio}",
+        'datos': {'equipo_id': "{id}"},
+    },
+    {
+        'id': 'garantia_por_vencer',
+        'agente': 'check-warranties',
+        'tabla': 'equipos',
+        'condicion': "e.fecha_garantia_fin BETWEEN :hoy AND :hoy + 60",
+        'cruce': "e.fecha_garantia_fin - 60",
+        # The day count in mensaje changes daily
+        'periodo': 'dia',
+        'tipo': 'garantia',
+        'prioridad': 'media',
+        'mensaje': "Garantía por vencer: {nombre} expira en {dias_garantia} días.",
+        'clave': "garantia:por_vencer:{id}:{fecha_garantia_fin}",
+        'datos': {'equipo_id': "{id}"},
+    },
+    {
+        'id': 'alto_costo',
+        'agente': 'analyze-maintenance-costs',
+        'tabla': 'equipos',
+        'condicion': "e.costo_compra > 0 AND c.total_mantenimiento > e.costo_compra * 0.5",
+        'cambio': "e.id IN (SELECT equipo_id FROM mantenimientos WHERE fecha_actualizacion > :marca)",
+        'uniones': ['c'],
+        # Once read, the alert comes back the following month
+        'periodo': 'mes',
+        'tipo': 'sistema',
+        'prioridad': 'alta',
+        'mensaje': "Alto Costo: Mantenimiento de {nombre} supera el 50% de su valor.",
+        'clave': "sistema:alto_costo:{id}:{mes}",
+        'datos': {'equipo_id': "{id}"},
+    },
+]
+
+PARAMETRO = re.compile(r"(?<![:\w]):(hoy|marca|previa)\b")
+MARCA = re.compile(r"(?<![:\w]):(marca|previa)\b")
+
+
+def validar(reglas):
+    ids = set()
+    for regla in reglas:
+        if regla['id'] in ids:
+            raise ValueError(f"Duplicate rule id '{regla['id']}'")
+        if regla['tabla'] not in BASES:
+            raise ValueError(f"Rule '{regla['id']}' uses unknown table '{regla['tabla']}'")
+        if regla.get('periodo') not in (None, 'anio', 'mes', 'dia'):
+            raise ValueError(f"Rule '{regla['id']}' has invalid periodo '{regla['periodo']}'")
+        for campo in ('condicion', 'cruce'):
+            if MARCA.search(regla.get(campo) or ''):
+                raise ValueError(f"Rule '{regla['id']}' uses :marca or :previa in {campo}; only cambio may")
+        for alias in regla.get('uniones', []):
+            if alias not in BASES[regla['tabla']].get('uniones', {}):
+                raise ValueError(f"Rule '{regla['id']}' uses unknown union '{alias}'")
+        ids.add(regla['id'])
+
+
+def cambios(regla: dict):
+    """Incremental filter of a rule: the row changed since the rule's last run, or
+    crossed its date threshold since then."""
+    partes = [f"{BASES[regla['tabla']]['actualizacion']} > :marca"]
+    if regla.get('cruce'):
+        partes.append(f"{regla['cruce']} > :previa")
+    if regla.get('cambio'):
+        partes.append(regla['cambio'])
+    return ' OR '.join(partes)
+
+
+def compilar(tabla: str, reglas: list, marcas: dict):
+    """Single-pass query for `reglas`, all over base `tabla`.
+
+    marcas maps the id of each rule evaluated incrementally to its (marca, previa);
+    the other rules are evaluated over the whole table. The query returns the base
+    columns plus `reglas`, the positions in `reglas` of the rules each row matches.
+    Parameter $1 is the run date. Returns (sql, extra parameters after $1).
+    """
+    base = BASES[tabla]
+    params = []
+
+    def sql(fragmento, regla_id=None):
+        def valor(match):
+            if match.group(1) == 'hoy':
+                return "$1::date"
+            params.append(marcas[regla_id][0 if match.group(1) == 'marca' else 1])
+            tipo = "timestamptz" if match.group(1) == 'marca' else "date"
+            return f"${len(params) + 1}::{tipo}"
+        return PARAMETRO.sub(valor, fragmento)
+
+    columnas = [f"{sql(expr)} as {nombre}" for nombre, expr in base['columnas'].items()]
+    casos, filtros = [], []
+    for i, regla in enumerate(reglas):
+        condicion = f"({sql(regla['condicion'])})"
+        if regla['id'] in marcas:
+            condicion += f" AND ({sql(cambios(regla), regla['id'])})"
+        # The row is tagged only with the rules whose incremental filter it passes
+        casos.append(f"CASE WHEN {condicion} THEN {i} END")
+        filtros.append(f"({condicion})")
+
+    desde = [base['desde']]
+    for alias, union in base.get('uniones', {}).items():
+        usan = [r for r in reglas if alias in r.get('uniones', [])]
+        if not usan:
+            continue
+        filtro = ""
+        if all(r['id'] in marcas for r in usan):
+            candidatos = ' OR '.join(f"({sql(cambios(r), r['id'])})" for r in usan)
+            filtro = f"WHERE {union['clave']} IN (SELECT {base['columnas']['id']} FROM {base['desde']} WHERE {candidatos})"
+        desde.append(f"LEFT JOIN ({union['sql'].format(filtro=filtro)}\n        ) {alias} ON {base['columnas']['id']} = {alias}.{union['clave']}")
+
+    query = f"""
+        SELECT {', '.join(columnas)},
+               array_remove(ARRAY[{', '.join(casos)}], NULL) as reglas
+        FROM {' '.join(desde)}
+        WHERE {' OR '.join(filtros)}
+    """
+    return query, params
+
+
+def notificacion(regla: dict, fila: dict):
+    """(clave_dedup, tipo, mensaje, prioridad, datos) for a matching row."""
+    return (
+        regla['clave'].format(**fila),
+        regla['tipo'],
+        regla['mensaje'].format(**fila),
+        regla['prioridad'],
+        {k: v.format(**fila) for k, v in regla.get('datos', {}).items()},
+    )
+
+
+validar(REGLAS)
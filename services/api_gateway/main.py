@@ -1,5 +1,7 @@
 from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 import httpx
 import os
 from dotenv import load_dotenv
@@ -35,6 +37,8 @@ SERVICES = {
 }
 
 client = httpx.AsyncClient()
+# Event streams stay open; the agent service sends a heartbeat every 15s by default
+STREAM_TIMEOUT = httpx.Timeout(5.0, read=float(os.getenv("STREAM_READ_TIMEOUT_SECONDS", "60")))
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -52,7 +56,7 @@ async def health_check():
             status[name] = "down"
     return {"gateway": "up", "services": status}
 
-async def proxy_request(service_name: str, path: str, request: Request, response: Response):
+async def proxy_request(service_name: str, path: str, request: Request, response: Response, timeout=None):
     url = f"{SERVICES[service_name]}/{path}"
     
     # Forward query params
@@ -67,15 +71,22 @@ async def proxy_request(service_name: str, path: str, request: Request, response
             url,
             headers=request.headers.raw,
             content=content,
-            params=params
+            params=params,
+            timeout=timeout or client.timeout
         )
-        rp_resp = await client.send(rp_req)
+        # Stream the upstream body so large exports are not buffered in the gateway
+        rp_resp = await client.send(rp_req, stream=True)
         
         # Exclude some headers
         excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
         headers = {k: v for k, v in rp_resp.headers.items() if k.lower() not in excluded_headers}
                 
-        return Response(content=rp_resp.content, status_code=rp_resp.status_code, headers=headers)
+        return StreamingResponse(
+            rp_resp.aiter_bytes(),
+            status_code=rp_resp.status_code,
+            headers=headers,
+            background=BackgroundTask(rp_resp.aclose)
+        )
     except httpx.RequestError as exc:
         raise HTTPException(status_code=503, detail=f"Service {service_name} unavailable: {str(exc)}")
 
@@ -88,14 +99,18 @@ async def equipos_proxy(path: str, request: Request, response: Response):
 async def proveedores_proxy(path: str, request: Request, response: Response):
     return await proxy_request("proveedores", path, request, response)
 
-@app.api_route("/api/mantenimientos/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+@app.api_route("/api/mantenimientos/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
 async def mantenimientos_proxy(path: str, request: Request, response: Response):
-    return await proxy_request("mantenimientos", path, request, response)
+    return await proxy_request("mantenimiento", path, request, response)
 
-@app.api_route("/api/reportes/{path:path}", methods=["GET", "POST"])
+@app.api_route("/api/reportes/{path:path}", methods=["GET", "POST", "DELETE"])
 async def reportes_proxy(path: str, request: Request, response: Response):
     return await proxy_request("reportes", path, request, response)
 
-@app.api_route("/api/agents/{path:path}", methods=["GET", "POST", "PUT"])
+@app.get("/api/agents/notificaciones/stream")
+async def notificaciones_stream_proxy(request: Request, response: Response):
+    return await proxy_request("agent", "notificaciones/stream", request, response, timeout=STREAM_TIMEOUT)
+
+@app.api_route("/api/agents/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def agents_proxy(path: str, request: Request, response: Response):
-    return await proxy_request("agents", path, request, response)
+    return await proxy_request("agent", path, request, response)
@@ -0,0 +1,81 @@
+import heapq
+from collections import defaultdict
+
+# Higher-priority orders are placed first so they get the least-loaded technicians
+# when capacity is scarce.
+PRIORIDAD_ORDEN = {'critica': 0, 'alta': 1, 'media': 2, 'baja': 3}
+
+# A technician already working at the same ubicacion that day (or whose usual
+# ubicacion it is) may take the order even if slightly busier than the least-loaded one.
+BONUS_MISMO_DIA = 2
+BONUS_UBICACION_HABITUAL = 1
+
+
+def asignar(ordenes, tecnicos, carga_actual, presencia_actual, ubicacion_habitual, capacidad_diaria):
+    """Greedy assignment of open orders to technicians.
+
+    ordenes: list of dicts with id, fecha_programada, prioridad, ubicacion_id
+    tecnicos: list of technician names
+    carga_actual: {(tecnico, fecha): orders already assigned}
+    presencia_actual: {(fecha, ubicacion_id): {tecnico: orders}}
+    ubicacion_habitual: {ubicacion_id: set of tecnicos}
+
+    Returns (asignaciones, sin_asignar) where asignaciones is a list of (id, tecnico).
+    Runs in O(n log t): the least-loaded technician per day comes from a lazy heap and
+    only the few affinity candidates are scored individually.
+    """
+    carga = defaultdict(int, carga_actual)
+    presencia = defaultdict(lambda: defaultdict(int))
+    for key, por_tecnico in presencia_actual.items():
+        presencia[key].update(por_tecnico)
+
+    heaps = {}
+
+    def menos_cargado(fecha):
+        heap = heaps.get(fecha)
+        if heap is None:
+            heap = [(carga[(t, fecha)], t) for t in tecnicos]
+            heapq.heapify(heap)
+            heaps[fecha] = heap
+        while heap:
+            load, tecnico = heap[0]
+            actual = carga[(tecnico, fecha)]
+            if load == actual:
+                return tecnico, actual
+            heapq.heapreplace(heap, (actual, tecnico))
+        return None, None
+
+    ordenes = sorted(ordenes, key=lambda o: (o['fecha_programada'], PRIORIDAD_ORDEN.get(o['prioridad'], 2)))
+
+    asignaciones = []
+    sin_asignar = []
+    for orden in ordenes:
+        fecha = orden['fecha_programada']
+        ubicacion = orden['ubicacion_id']
+
+        mejor, mejor_carga = menos_cargado(fecha)
+        if mejor is None or mejor_carga >= capacidad_diaria:
+            sin_asignar.append(orden['id'])
+            continue
+        mejor_score = mejor_carga
+
+        presentes = presencia[(fecha, ubicacion)] if ubicacion else {}
+        habituales = ubicacion_habitual.get(ubicacion, ())
+        for tecnico in set(presentes) | set(habituales):
+            load = carga[(tecnico, fecha)]
+            if load >= capacidad_diaria:
+                continue
+            score = load
+            if tecnico in presentes:
+                score -= BONUS_MISMO_DIA
+            if tecnico in habituales:
+                score -= BONUS_UBICACION_HABITUAL
+            if score < mejor_score or (score == mejor_score and tecnico < mejor):
+                mejor, mejor_score = tecnico, score
+
+        carga[(mejor, fecha)] += 1
+        if ubicacion:
+            presencia[(fecha, ubicacion)][mejor] += 1
+        asignaciones.append((orden['id'], mejor))
+
+    return asignaciones, sin_asignar
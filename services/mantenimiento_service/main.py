@@ -1,15 +1,24 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Response
 from pydantic import BaseModel
 from typing import List, Optional
 import asyncpg
+import base64
+import json
 import os
+import time
+import uuid
+from collections import defaultdict
 from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
+from asignacion import asignar
 
 load_dotenv()
 
 app = FastAPI(title="Mantenimiento Service")
 
+# Maximum open orders per technician per day considered by the assignment engine
+TECNICO_CAPACIDAD_DIARIA = int(os.getenv("TECNICO_CAPACIDAD_DIARIA", "8"))
+
 # Database connection
 async def get_db_connection():
     return await asyncpg.connect(
@@ -47,57 +56,150 @@ class MantenimientoUpdate(BaseModel):
     tecnico_responsable: Optional[str] = None
     notas_tecnicas: Optional[str] = None
 
+class MantenimientoFiltro(BaseModel):
+    estado: Optional[str] = None
+    tipo: Optional[str] = None
+    equipo_id: Optional[str] = None
+    ubicacion_id: Optional[str] = None
+    fecha_programada: Optional[date] = None
+    fecha_inicio: Optional[date] = None
+    fecha_fin: Optional[date] = None
+
+class MantenimientoBulkUpdate(BaseModel):
+    ids: Optional[List[str]] = None
+    filtro: Optional[MantenimientoFiltro] = None
+    cambios: MantenimientoUpdate
+    estado_equipo: Optional[str] = None # Si se indica, actualiza equipos.estado de los equipos afectados
+
+class PlanMantenimientoCreate(BaseModel):
+    nombre: str
+    tipo: str = "preventivo"
+    prioridad: str = "media"
+    descripcion: Optional[str] = None
+    tecnico_responsable: Optional[str] = None
+    frecuencia_valor: int
+    frecuencia_unidad: str # 'dias', 'semanas', 'meses', 'anios'
+    fecha_inicio: date
+    fecha_fin: Optional[date] = None
+    categoria_id: Optional[str] = None
+    ubicacion_id: Optional[str] = None
+    equipo_ids: Optional[List[str]] = None
+
+FRECUENCIA_UNIDADES = ('dias', 'semanas', 'meses', 'anios')
+
+def build_set_clause(update_data: dict, param_idx: int = 1):
+    # Keys come from the Pydantic model, so only known columns reach the SQL
+    fields = []
+    params = []
+    for key, value in update_data.items():
+        fields.append(f"{key} = ${param_idx}")
+        params.append(value)
+        param_idx += 1
+    return ", ".join(fields), params, param_idx
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+# Sort keys allowed on GET /mantenimientos. Each one is paired with m.id as a
+# tiebreaker and backed by (..., <key>, id) indexes in schema.sql (see the comment there
+# for which filter combinations avoid a Sort).
+SORT_KEYS = {
+    'fecha_programada': ('m.fecha_programada', date.fromisoformat),
+    'fecha_creacion': ('m.fecha_creacion', datetime.fromisoformat),
+}
+
+def encode_cursor(value, id) -> str:
+    payload = json.dumps({"v": value.isoformat(), "id": str(id)})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str, orden: str):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return SORT_KEYS[orden][1](payload["v"]), uuid.UUID(payload["id"])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+PAGE_SIZE = 200
+
+def build_mantenimientos_query(estado=None, tipo=None, equipo_id=None, fecha_inicio=None, fecha_fin=None,
+                               orden="fecha_programada", direccion="desc", limit=None, cursor=None):
+    """Query and params for GET /mantenimientos; also used by scripts/check_mantenimientos_indexes.py."""
+    query = """
+        SELECT m.*, e.nombre as equipo_nombre, e.codigo_inventario 
+        FROM mantenimientos m
+        JOIN equipos e ON m.equipo_id = e.id
+        WHERE 1=1
+    """
+    params = []
+    param_idx = 1
+    
+    if estado:
+        query += f" AND m.estado = ${param_idx}"
+        params.append(estado)
+        param_idx += 1
+        
+    if tipo:
+        query += f" AND m.tipo = ${param_idx}"
+        params.append(tipo)
+        param_idx += 1
+        
+    if equipo_id:
+        query += f" AND m.equipo_id = ${param_idx}"
+        params.append(equipo_id)
+        param_idx += 1
+        
+    if fecha_inicio:
+        query += f" AND m.fecha_programada >= ${param_idx}"
+        params.append(fecha_inicio)
+        param_idx += 1
+        
+    if fecha_fin:
+        query += f" AND m.fecha_programada <= ${param_idx}"
+        params.append(fecha_fin)
+        param_idx += 1
+
+    sort_column = SORT_KEYS[orden][0]
+    if cursor:
+        cursor_value, cursor_id = decode_cursor(cursor, orden)
+        operator = "<" if direccion == "desc" else ">"
+        query += f" AND ({sort_column}, m.id) {operator} (${param_idx}, ${param_idx + 1}::uuid)"
+        params.extend([cursor_value, cursor_id])
+        param_idx += 2
+        
+    query += f" ORDER BY {sort_column} {direccion.upper()}, m.id {direccion.upper()}"
+    if limit:
+        query += f" LIMIT ${param_idx}"
+        params.append(limit + 1)
+    return query, params
+
 @app.get("/mantenimientos")
 async def get_mantenimientos(
+    response: Response,
     estado: Optional[str] = None,
     tipo: Optional[str] = None,
     equipo_id: Optional[str] = None,
     fecha_inicio: Optional[date] = None,
-    fecha_fin: Optional[date] = None
+    fecha_fin: Optional[date] = None,
+    orden: str = Query("fecha_programada", pattern="^(fecha_programada|fecha_creacion)$"),
+    direccion: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None
 ):
+    # Keyset pagination: the next page cursor is returned in the X-Next-Cursor header
+    # so the body stays a plain list for existing clients. Without limit or cursor every
+    # row is returned, as before pagination existed; a cursor alone pages by PAGE_SIZE.
+    if cursor and not limit:
+        limit = PAGE_SIZE
+    query, params = build_mantenimientos_query(
+        estado, tipo, equipo_id, fecha_inicio, fecha_fin, orden, direccion, limit, cursor)
     conn = await get_db_connection()
     try:
-        query = """
-            SELECT m.*, e.nombre as equipo_nombre, e.codigo_inventario 
-            FROM mantenimientos m
-            JOIN equipos e ON m.equipo_id = e.id
-            WHERE 1=1
-        """
-        params = []
-        param_idx = 1
-        
-        if estado:
-            query += f" AND m.estado = ${param_idx}"
-            params.append(estado)
-            param_idx += 1
-            
-        if tipo:
-            query += f" AND m.tipo = ${param_idx}"
-            params.append(tipo)
-            param_idx += 1
-            
-        if equipo_id:
-            query += f" AND m.equipo_id = ${param_idx}"
-            params.append(equipo_id)
-            param_idx += 1
-            
-        if fecha_inicio:
-            query += f" AND m.fecha_programada >= ${param_idx}"
-            params.append(fecha_inicio)
-            param_idx += 1
-            
-        if fecha_fin:
-            query += f" AND m.fecha_programada <= ${param_idx}"
-            params.append(fecha_fin)
-            param_idx += 1
-            
-        query += " ORDER BY m.fecha_programada DESC"
-            
         rows = await conn.fetch(query, *params)
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            response.headers["X-Next-Cursor"] = encode_cursor(last[orden], last['id'])
         return [dict(row) for row in rows]
     finally:
         await conn.close()
@@ -124,9 +226,20 @@ async def get_mantenimiento(id: str):
         await conn.close()
 
 @app.post("/mantenimientos")
-async def create_mantenimiento(mantenimiento: MantenimientoCreate):
+async def create_mantenimiento(mantenimiento: MantenimientoCreate, auto_asignar: bool = False):
     conn = await get_db_connection()
     try:
+        if auto_asignar and not mantenimiento.tecnico_responsable:
+            ubicacion_id = await conn.fetchval("SELECT ubicacion_actual_id FROM equipos WHERE id = $1", mantenimiento.equipo_id)
+            fecha = mantenimiento.fecha_programada
+            contexto = await cargar_contexto_asignacion(conn, fecha, fecha)
+            asignaciones, _ = asignar(
+                [{'id': None, 'fecha_programada': fecha, 'prioridad': mantenimiento.prioridad, 'ubicacion_id': ubicacion_id}],
+                *contexto, TECNICO_CAPACIDAD_DIARIA
+            )
+            if asignaciones:
+                mantenimiento.tecnico_responsable = asignaciones[0][1]
+
         query = """
             INSERT INTO mantenimientos (
                 equipo_id, tipo, prioridad, estado, fecha_programada, 
@@ -140,7 +253,68 @@ async def create_mantenimiento(mantenimiento: MantenimientoCreate):
             mantenimiento.costo, mantenimiento.descripcion, mantenimiento.tecnico_responsable,
             mantenimiento.notas_tecnicas
         )
-        return {"id": row['id'], "message": "Mantenimiento created successfully"}
+        return {"id": row['id'], "tecnico_responsable": mantenimiento.tecnico_responsable, "message": "Mantenimiento created successfully"}
+    finally:
+        await conn.close()
+
+@app.patch("/mantenimientos/bulk")
+async def bulk_update_mantenimientos(bulk: MantenimientoBulkUpdate):
+    set_clause, params, param_idx = build_set_clause(bulk.cambios.dict(exclude_unset=True))
+    if not set_clause:
+        return {"message": "No changes provided", "actualizados": 0}
+
+    filtro = bulk.filtro.dict(exclude_none=True) if bulk.filtro else {}
+    if not bulk.ids and not filtro:
+        raise HTTPException(status_code=400, detail="Provide ids or at least one filter")
+
+    conditions = []
+    if bulk.ids:
+        conditions.append(f"m.id = ANY(${param_idx}::uuid[])")
+        params.append(bulk.ids)
+        param_idx += 1
+
+    filter_columns = {
+        'estado': "m.estado = ${}",
+        'tipo': "m.tipo = ${}",
+        'equipo_id': "m.equipo_id = ${}",
+        'ubicacion_id': "e.ubicacion_actual_id = ${}",
+        'fecha_programada': "m.fecha_programada = ${}",
+        'fecha_inicio': "m.fecha_programada >= ${}",
+        'fecha_fin': "m.fecha_programada <= ${}",
+    }
+    for key, value in filtro.items():
+        conditions.append(filter_columns[key].format(param_idx))
+        params.append(value)
+        param_idx += 1
+
+    query = f"""
+        UPDATE mantenimientos m SET {set_clause}
+        FROM equipos e
+        WHERE m.equipo_id = e.id
+        AND {' AND '.join(conditions)}
+        RETURNING m.id, m.equipo_id
+    """
+
+    conn = await get_db_connection()
+    try:
+        async with conn.transaction():
+            rows = await conn.fetch(query, *params)
+
+            equipos_actualizados = 0
+            if bulk.estado_equipo and rows:
+                equipo_ids = list({row['equipo_id'] for row in rows})
+                result = await conn.execute(
+                    "UPDATE equipos SET estado = $1 WHERE id = ANY($2::uuid[])",
+                    bulk.estado_equipo, equipo_ids
+                )
+                equipos_actualizados = int(result.split()[-1])
+
+        return {
+            "message": "Mantenimientos updated successfully",
+            "actualizados": len(rows),
+            "ids": [row['id'] for row in rows],
+            "equipos_actualizados": equipos_actualizados
+        }
     finally:
         await conn.close()
 
@@ -148,21 +322,13 @@ async def create_mantenimiento(mantenimiento: MantenimientoCreate):
 async def update_mantenimiento(id: str, mantenimiento: MantenimientoUpdate):
     conn = await get_db_connection()
     try:
-        fields = []
-        params = []
-        param_idx = 1
-        
-        update_data = mantenimiento.dict(exclude_unset=True)
-        for key, value in update_data.items():
-            fields.append(f"{key} = ${param_idx}")
-            params.append(value)
-            param_idx += 1
+        set_clause, params, param_idx = build_set_clause(mantenimiento.dict(exclude_unset=True))
             
-        if not fields:
+        if not set_clause:
             return {"message": "No changes provided"}
             
         params.append(id)
-        query = f"UPDATE mantenimientos SET {', '.join(fields)} WHERE id = ${param_idx}"
+        query = f"UPDATE mantenimientos SET {set_clause} WHERE id = ${param_idx}"
         
         result = await conn.execute(query, *params)
         if result == "UPDATE 0":
@@ -213,3 +379,310 @@ async def get_proximos(dias: int = 7):
         return [dict(row) for row in rows]
     finally:
         await conn.close()
+
+# Technician workload and assignment
+
+async def cargar_contexto_asignacion(conn, fecha_inicio: date, fecha_fin: date):
+    tecnicos = [row['nombre'] for row in await conn.fetch(
+        "SELECT nombre FROM usuarios WHERE rol = 'tecnico' ORDER BY nombre"
+    )]
+
+    carga = {}
+    presencia = defaultdict(dict)
+    rows = await conn.fetch("""
+        SELECT m.tecnico_responsable, m.fecha_programada, e.ubicacion_actual_id, COUNT(*) as cantidad
+        FROM mantenimientos m
+        JOIN equipos e ON m.equipo_id = e.id
+        WHERE m.estado IN ('programado', 'en_proceso')
+        AND m.fecha_programada BETWEEN $1 AND $2
+        AND COALESCE(m.tecnico_responsable, '') != ''
+        GROUP BY m.tecnico_responsable, m.fecha_programada, e.ubicacion_actual_id
+    """, fecha_inicio, fecha_fin)
+    for row in rows:
+        key = (row['tecnico_responsable'], row['fecha_programada'])
+        carga[key] = carga.get(key, 0) + row['cantidad']
+        if row['ubicacion_actual_id']:
+            presencia[(row['fecha_programada'], row['ubicacion_actual_id'])][row['tecnico_responsable']] = row['cantidad']
+
+    # Usual ubicacion per technician: where most of their last 180 days of work happened
+    habitual = defaultdict(set)
+    rows = await conn.fetch("""
+        SELECT DISTINCT ON (m.tecnico_responsable) m.tecnico_responsable, e.ubicacion_actual_id
+        FROM mantenimientos m
+        JOIN equipos e ON m.equipo_id = e.id
+        WHERE m.tecnico_responsable = ANY($1::text[])
+        AND m.fecha_programada >= CURRENT_DATE - 180
+        AND e.ubicacion_actual_id IS NOT NULL
+        GROUP BY m.tecnico_responsable, e.ubicacion_actual_id
+        ORDER BY m.tecnico_responsable, COUNT(*) DESC
+    """, tecnicos)
+    for row in rows:
+        habitual[row['ubicacion_actual_id']].add(row['tecnico_responsable'])
+
+    return tecnicos, carga, presencia, habitual
+
+@app.get("/tecnicos/carga")
+async def get_carga_tecnicos(fecha_inicio: Optional[date] = None, fecha_fin: Optional[date] = None):
+    fecha_inicio = fecha_inicio or date.today()
+    fecha_fin = fecha_fin or fecha_inicio + timedelta(days=6)
+    if fecha_fin < fecha_inicio:
+        raise HTTPException(status_code=400, detail="fecha_fin must be after fecha_inicio")
+
+    conn = await get_db_connection()
+    try:
+        tecnicos = [row['nombre'] for row in await conn.fetch(
+            "SELECT nombre FROM usuarios WHERE rol = 'tecnico' ORDER BY nombre"
+        )]
+        rows = await conn.fetch("""
+            SELECT NULLIF(m.tecnico_responsable, '') as tecnico, m.fecha_programada, COUNT(*) as cantidad
+            FROM mantenimientos m
+            WHERE m.estado IN ('programado', 'en_proceso')
+            AND m.fecha_programada BETWEEN $1 AND $2
+            GROUP BY NULLIF(m.tecnico_responsable, ''), m.fecha_programada
+        """, fecha_inicio, fecha_fin)
+    finally:
+        await conn.close()
+
+    fechas = [fecha_inicio + timedelta(days=i) for i in range((fecha_fin - fecha_inicio).days + 1)]
+    indice = {f: i for i, f in enumerate(fechas)}
+    matriz = {t: [0] * len(fechas) for t in tecnicos}
+    sin_asignar = [0] * len(fechas)
+    for row in rows:
+        if row['tecnico'] is None:
+            sin_asignar[indice[row['fecha_programada']]] += row['cantidad']
+        else:
+            matriz.setdefault(row['tecnico'], [0] * len(fechas))[indice[row['fecha_programada']]] += row['cantidad']
+
+    return {
+        "fechas": fechas,
+        "capacidad_diaria": TECNICO_CAPACIDAD_DIARIA,
+        "tecnicos": [
+            {"tecnico": t, "carga": carga, "total": sum(carga)}
+            for t, carga in sorted(matriz.items())
+        ],
+        "sin_asignar": sin_asignar
+    }
+
+@app.post("/asignaciones/auto")
+async def auto_asignar_ordenes(
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    dry_run: bool = False
+):
+    fecha_inicio = fecha_inicio or date.today()
+    fecha_fin = fecha_fin or fecha_inicio + timedelta(days=6)
+    if fecha_fin < fecha_inicio:
+        raise HTTPException(status_code=400, detail="fecha_fin must be after fecha_inicio")
+
+    conn = await get_db_connection()
+    try:
+        ordenes = await conn.fetch("""
+            SELECT m.id, m.fecha_programada, m.prioridad, e.ubicacion_actual_id as ubicacion_id
+            FROM mantenimientos m
+            JOIN equipos e ON m.equipo_id = e.id
+            WHERE m.estado IN ('programado', 'en_proceso')
+            AND m.fecha_programada BETWEEN $1 AND $2
+            AND COALESCE(m.tecnico_responsable, '') = ''
+        """, fecha_inicio, fecha_fin)
+        contexto = await cargar_contexto_asignacion(conn, fecha_inicio, fecha_fin)
+        if not contexto[0]:
+            raise HTTPException(status_code=409, detail="No technicians registered (usuarios.rol = 'tecnico')")
+
+        inicio = time.perf_counter()
+        asignaciones, sin_asignar = asignar(ordenes, *contexto, TECNICO_CAPACIDAD_DIARIA)
+        duracion_ms = (time.perf_counter() - inicio) * 1000
+
+        actualizados = 0
+        if asignaciones and not dry_run:
+            # Only fill orders that are still unassigned, in case someone assigned them meanwhile
+            result = await conn.execute("""
+                UPDATE mantenimientos m SET tecnico_responsable = a.tecnico
+                FROM unnest($1::uuid[], $2::text[]) AS a(id, tecnico)
+                WHERE m.id = a.id
+                AND COALESCE(m.tecnico_responsable, '') = ''
+            """, [a[0] for a in asignaciones], [a[1] for a in asignaciones])
+            actualizados = int(result.split()[-1])
+
+        por_tecnico = defaultdict(int)
+        for _, tecnico in asignaciones:
+            por_tecnico[tecnico] += 1
+
+        return {
+            "ordenes": len(ordenes),
+            "asignadas": len(asignaciones),
+            "actualizadas": actualizados,
+            "sin_capacidad": sin_asignar,
+            "por_tecnico": dict(por_tecnico),
+            "duracion_ms": round(duracion_ms, 2),
+            "dry_run": dry_run
+        }
+    finally:
+        await conn.close()
+
+# Maintenance plans
+
+# Materializes the occurrences of every selected plan with a single INSERT ... SELECT.
+# Occurrence n is fecha_inicio + n * paso (adding the step repeatedly would drift, e.g.
+# Jan 31 -> Feb 28 -> Mar 28), so the series stays anchored at fecha_inicio and
+# re-running only adds the dates past generado_hasta; the unique index on
+# (plan_id, equipo_id, fecha_programada) absorbs any overlap. Past dates are never
+# generated, even for plans whose fecha_inicio is in the past.
+GENERAR_OCURRENCIAS_SQL = """
+    WITH planes AS (
+        SELECT p.*,
+            CASE p.frecuencia_unidad
+                WHEN 'dias' THEN make_interval(days => p.frecuencia_valor)
+                WHEN 'semanas' THEN make_interval(weeks => p.frecuencia_valor)
+                WHEN 'meses' THEN make_interval(months => p.frecuencia_valor)
+                WHEN 'anios' THEN make_interval(years => p.frecuencia_valor)
+            END AS paso,
+            -- Shortest and longest length of one step in days, to bound n
+            p.frecuencia_valor * CASE p.frecuencia_unidad
+                WHEN 'dias' THEN 1 WHEN 'semanas' THEN 7 WHEN 'meses' THEN 28 WHEN 'anios' THEN 365
+            END AS dias_min,
+            p.frecuencia_valor * CASE p.frecuencia_unidad
+                WHEN 'dias' THEN 1 WHEN 'semanas' THEN 7 WHEN 'meses' THEN 31 WHEN 'anios' THEN 366
+            END AS dias_max,
+            GREATEST(p.fecha_inicio, CURRENT_DATE) AS desde,
+            LEAST($2::date, COALESCE(p.fecha_fin, $2::date)) AS limite
+        FROM planes_mantenimiento p
+        WHERE p.activo = TRUE
+        AND ($1::uuid IS NULL OR p.id = $1::uuid)
+    ),
+    ocurrencias AS (
+        SELECT p.id AS plan_id, (p.fecha_inicio + n * p.paso)::date AS fecha_programada
+        FROM planes p,
+        LATERAL generate_series((p.desde - p.fecha_inicio) / p.dias_max, (p.limite - p.fecha_inicio) / p.dias_min) n
+        WHERE (p.fecha_inicio + n * p.paso)::date BETWEEN p.desde AND p.limite
+        AND ($3::boolean OR (p.fecha_inicio + n * p.paso)::date > COALESCE(p.generado_hasta, p.fecha_inicio - 1))
+    ),
+    insertados AS (
+        INSERT INTO mantenimientos (
+            equipo_id, plan_id, tipo, prioridad, estado, fecha_programada,
+            descripcion, tecnico_responsable
+        )
+        SELECT e.id, p.id, p.tipo, p.prioridad, 'programado', o.fecha_programada,
+               p.descripcion, p.tecnico_responsable
+        FROM ocurrencias o
+        JOIN planes p ON p.id = o.plan_id
+        JOIN equipos e ON e.estado != 'baja'
+            AND (p.categoria_id IS NULL OR e.categoria_id = p.categoria_id)
+            AND (p.ubicacion_id IS NULL OR e.ubicacion_actual_id = p.ubicacion_id)
+            AND (p.equipo_ids IS NULL OR e.id = ANY(p.equipo_ids))
+        ON CONFLICT (plan_id, equipo_id, fecha_programada) WHERE plan_id IS NOT NULL DO NOTHING
+        RETURNING plan_id
+    )
+    SELECT plan_id, COUNT(*) AS creados
+    FROM insertados
+    GROUP BY plan_id
+"""
+
+async def generar_ocurrencias(conn, plan_id: Optional[str], hasta: date, rellenar: bool):
+    async with conn.transaction():
+        rows = await conn.fetch(GENERAR_OCURRENCIAS_SQL, plan_id, hasta, rellenar)
+        await conn.execute("""
+            UPDATE planes_mantenimiento
+            SET generado_hasta = GREATEST(generado_hasta, LEAST($2::date, COALESCE(fecha_fin, $2::date)))
+            WHERE activo = TRUE
+            AND ($1::uuid IS NULL OR id = $1::uuid)
+        """, plan_id, hasta)
+    return {str(row['plan_id']): row['creados'] for row in rows}
+
+@app.get("/planes")
+async def get_planes(activo: Optional[bool] = True):
+    conn = await get_db_connection()
+    try:
+        query = """
+            SELECT p.*, c.nombre as categoria_nombre, u.nombre as ubicacion_nombre
+            FROM planes_mantenimiento p
+            LEFT JOIN categorias_equipos c ON p.categoria_id = c.id
+            LEFT JOIN ubicaciones u ON p.ubicacion_id = u.id
+            WHERE 1=1
+        """
+        params = []
+        if activo is not None:
+            query += " AND p.activo = $1"
+            params.append(activo)
+
+        query += " ORDER BY p.fecha_creacion DESC"
+
+        rows = await conn.fetch(query, *params)
+        return [dict(row) for row in rows]
+    finally:
+        await conn.close()
+
+@app.post("/planes")
+async def create_plan(plan: PlanMantenimientoCreate):
+    if plan.frecuencia_unidad not in FRECUENCIA_UNIDADES:
+        raise HTTPException(status_code=400, detail=f"frecuencia_unidad must be one of {', '.join(FRECUENCIA_UNIDADES)}")
+    if plan.frecuencia_valor < 1:
+        raise HTTPException(status_code=400, detail="frecuencia_valor must be positive")
+    if not (plan.categoria_id or plan.ubicacion_id or plan.equipo_ids):
+        raise HTTPException(status_code=400, detail="Plan must target a categoria, an ubicacion or a list of equipos")
+    if plan.fecha_fin and plan.fecha_fin < plan.fecha_inicio:
+        raise HTTPException(status_code=400, detail="fecha_fin must be after fecha_inicio")
+
+    conn = await get_db_connection()
+    try:
+        row = await conn.fetchrow("""
+            INSERT INTO planes_mantenimiento (
+                nombre, tipo, prioridad, descripcion, tecnico_responsable,
+                frecuencia_valor, frecuencia_unidad, fecha_inicio, fecha_fin,
+                categoria_id, ubicacion_id, equipo_ids
+            ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+            RETURNING id
+        """,
+            plan.nombre, plan.tipo, plan.prioridad, plan.descripcion, plan.tecnico_responsable,
+            plan.frecuencia_valor, plan.frecuencia_unidad, plan.fecha_inicio, plan.fecha_fin,
+            plan.categoria_id, plan.ubicacion_id, plan.equipo_ids
+        )
+        return {"id": row['id'], "message": "Plan created successfully"}
+    finally:
+        await conn.close()
+
+@app.delete("/planes/{id}")
+async def deactivate_plan(id: str, eliminar_pendientes: bool = False):
+    conn = await get_db_connection()
+    try:
+        async with conn.transaction():
+            result = await conn.execute("UPDATE planes_mantenimiento SET activo = FALSE WHERE id = $1", id)
+            if result == "UPDATE 0":
+                raise HTTPException(status_code=404, detail="Plan not found")
+
+            cancelados = 0
+            if eliminar_pendientes:
+                result = await conn.execute("""
+                    UPDATE mantenimientos SET estado = 'cancelado'
+                    WHERE plan_id = $1 AND estado = 'programado' AND fecha_programada >= CURRENT_DATE
+                """, id)
+                cancelados = int(result.split()[-1])
+
+        return {"message": "Plan deactivated successfully", "cancelados": cancelados}
+    finally:
+        await conn.close()
+
+@app.post("/planes/generar")
+async def generar_planes(horizonte_dias: int = Query(365, ge=1, le=1825), rellenar: bool = False):
+    # rellenar=true restarts the window at today, which also picks up equipos that
+    # joined a plan's categoria/ubicacion after it was last generated
+    conn = await get_db_connection()
+    try:
+        hasta = date.today() + timedelta(days=horizonte_dias)
+        creados = await generar_ocurrencias(conn, None, hasta, rellenar)
+        return {"hasta": hasta, "creados": sum(creados.values()), "por_plan": creados}
+    finally:
+        await conn.close()
+
+@app.post("/planes/{id}/generar")
+async def generar_plan(id: str, horizonte_dias: int = Query(365, ge=1, le=1825), rellenar: bool = False):
+    conn = await get_db_connection()
+    try:
+        exists = await conn.fetchval("SELECT 1 FROM planes_mantenimiento WHERE id = $1 AND activo = TRUE", id)
+        if not exists:
+            raise HTTPException(status_code=404, detail="Plan not found")
+
+        hasta = date.today() + timedelta(days=horizonte_dias)
+        creados = await generar_ocurrencias(conn, id, hasta, rellenar)
+        return {"hasta": hasta, "creados": sum(creados.values())}
+    finally:
+        await conn.close()
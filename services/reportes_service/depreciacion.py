@@ -0,0 +1,53 @@
+import numpy as np
+
+# Straight-line depreciation for the whole inventory. Assets are passed as column
+# arrays (one entry per asset) and rates per group, so the whole schedule is computed
+# with array operations instead of a Python loop per asset and month.
+
+
+def valor_libros(costo, edad_meses, tasa_mensual, vida_meses, horizonte):
+    """Book value at the end of months 0..horizonte from the cutoff.
+
+    costo, edad_meses, tasa_mensual, vida_meses: one entry per row. edad_meses is
+    counted from the purchase month, which keeps its full value; it is negative for
+    assets bought after the cutoff, which are worth nothing until then. An asset is
+    fully depreciated once it reaches vida_meses (np.inf when unknown).
+
+    Returns an array of shape (rows, horizonte + 1).
+    """
+    edad = edad_meses[:, None] + np.arange(horizonte + 1)
+    fraccion = np.clip(1.0 - tasa_mensual[:, None] * edad, 0.0, 1.0)
+    fraccion[edad >= vida_meses[:, None]] = 0.0
+    fraccion[edad < 0] = 0.0
+    return costo[:, None] * fraccion
+
+
+def proyectar(costo, edad_meses, grupo, tasa_mensual, vida_meses, n_grupos, horizonte):
+    """Sum of book values per group for months 0..horizonte.
+
+    costo, edad_meses, grupo: one entry per asset, grupo in [0, n_grupos).
+    tasa_mensual, vida_meses: one entry per group.
+
+    Assets of the same group and age follow the same schedule scaled by their cost,
+    so costs are first summed per (grupo, edad) and the schedule is computed once per
+    bucket. The result is exact and its size no longer depends on the asset count.
+
+    Returns an array of shape (n_grupos, horizonte + 1).
+    """
+    resultado = np.zeros((n_grupos, horizonte + 1))
+    if len(costo) == 0:
+        return resultado
+
+    edad_min = edad_meses.min()
+    rango = int(edad_meses.max() - edad_min) + 1
+    claves, posicion = np.unique(grupo.astype(np.int64) * rango + (edad_meses - edad_min), return_inverse=True)
+    costo_bucket = np.bincount(posicion, weights=costo)
+    grupo_bucket = claves // rango
+    edad_bucket = claves % rango + edad_min
+
+    valores = valor_libros(costo_bucket, edad_bucket, tasa_mensual[grupo_bucket], vida_meses[grupo_bucket], horizonte)
+
+    # np.unique returns the keys sorted, so each group's buckets are contiguous
+    inicios = np.flatnonzero(np.r_[True, grupo_bucket[1:] != grupo_bucket[:-1]])
+    resultado[grupo_bucket[inicios]] = np.add.reduceat(valores, inicios, axis=0)
+    return resultado
@@ -1,16 +1,22 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Response, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import asyncpg
+import asyncio
+import base64
+import hashlib
+import json
 import os
-import pandas as pd
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
 from dotenv import load_dotenv
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
+from render import EXPORT_DIR, render_export
+from depreciacion import proyectar
+import numpy as np
 import uuid
 
 load_dotenv()
@@ -27,263 +33,994 @@ async def get_db_connection():
         port=os.getenv("POSTGRES_PORT")
     )
 
+# Pooled connections for /bundle, which runs several queries at once
+db_pool = None
+DB_POOL_SIZE = int(os.getenv("REPORTES_DB_POOL_SIZE", "8"))
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
-@app.get("/dashboard")
-async def get_dashboard():
+class CachedValue:
+    """In-process cache for a single value with stale-while-revalidate.
+
+    Within `ttl` seconds the cached value is returned as is. Up to `stale_ttl` seconds
+    after that it is still returned, but a background refresh is started. Past that,
+    callers wait for the refresh. Concurrent callers share one in-flight refresh.
+    """
+
+    def __init__(self, loader, ttl: float, stale_ttl: float):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.value = None
+        self.loaded_at = 0.0
+        self._refresh_task = None
+
+    async def get(self):
+        age = time.monotonic() - self.loaded_at
+        if self.value is not None:
+            if age < self.ttl:
+                return self.value
+            if age < self.ttl + self.stale_ttl:
+                self._start_refresh()
+                return self.value
+        return await asyncio.shield(self._start_refresh())
+
+    def invalidate(self):
+        self.loaded_at = 0.0
+
+    def _start_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+            # Background refreshes may fail with nobody awaiting them
+            self._refresh_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._refresh_task
+
+    async def _refresh(self):
+        value = await self.loader()
+        self.value = value
+        self.loaded_at = time.monotonic()
+        return value
+
+async def load_dashboard():
     conn = await get_db_connection()
     try:
-        total_equipos = await conn.fetchval("SELECT COUNT(*) FROM equipos")
-        equipos_mantenimiento = await conn.fetchval("SELECT COUNT(*) FROM equipos WHERE estado = 'mantenimiento'")
-        mantenimientos_pendientes = await conn.fetchval("SELECT COUNT(*) FROM mantenimientos WHERE estado IN ('programado', 'en_proceso')")
-        costo_total_mes = await conn.fetchval("""
-            SELECT COALESCE(SUM(costo), 0) FROM mantenimientos 
-            WHERE fecha_realizacion >= date_trunc('month', CURRENT_DATE)
+        # One statement, one scan per table; the month cost comes from the daily fact table
+        row = await conn.fetchrow("""
+            SELECT eq.total_equipos, eq.equipos_mantenimiento,
+                   mt.mantenimientos_pendientes, cd.costo_mantenimiento_mes
+            FROM (
+                SELECT COUNT(*) as total_equipos,
+                       COUNT(*) FILTER (WHERE estado = 'mantenimiento') as equipos_mantenimiento
+                FROM equipos
+            ) eq,
+            (
+                SELECT COUNT(*) FILTER (WHERE estado IN ('programado', 'en_proceso')) as mantenimientos_pendientes
+                FROM mantenimientos
+            ) mt,
+            (
+                SELECT COALESCE(SUM(costo_total), 0) as costo_mantenimiento_mes
+                FROM mantenimiento_costos_diarios
+                WHERE fecha >= date_trunc('month', CURRENT_DATE)
+            ) cd
         """)
-        
         return {
-            "total_equipos": total_equipos,
-            "equipos_mantenimiento": equipos_mantenimiento,
-            "mantenimientos_pendientes": mantenimientos_pendientes,
-            "costo_mantenimiento_mes": float(costo_total_mes)
+            "total_equipos": row['total_equipos'],
+            "equipos_mantenimiento": row['equipos_mantenimiento'],
+            "mantenimientos_pendientes": row['mantenimientos_pendientes'],
+            "costo_mantenimiento_mes": float(row['costo_mantenimiento_mes']),
+            "actualizado_en": datetime.now().astimezone().isoformat()
         }
     finally:
         await conn.close()
 
+dashboard_cache = CachedValue(
+    load_dashboard,
+    ttl=float(os.getenv("DASHBOARD_CACHE_TTL", "15")),
+    stale_ttl=float(os.getenv("DASHBOARD_CACHE_STALE_TTL", "300"))
+)
+
+@app.get("/dashboard")
+async def get_dashboard(fresh: bool = False):
+    if fresh:
+        dashboard_cache.invalidate()
+    return await dashboard_cache.get()
+
+async def fetch_equipos_por_ubicacion(conn):
+    rows = await conn.fetch("""
+        SELECT u.nombre, COUNT(e.id) as cantidad
+        FROM ubicaciones u
+        LEFT JOIN equipos e ON u.id = e.ubicacion_actual_id
+        GROUP BY u.nombre
+        ORDER BY cantidad DESC
+    """)
+    return [dict(row) for row in rows]
+
 @app.get("/equipos-por-ubicacion")
 async def get_equipos_por_ubicacion():
     conn = await get_db_connection()
     try:
-        rows = await conn.fetch("""
-            SELECT u.nombre, COUNT(e.id) as cantidad
-            FROM ubicaciones u
-            LEFT JOIN equipos e ON u.id = e.ubicacion_actual_id
-            GROUP BY u.nombre
-            ORDER BY cantidad DESC
-        """)
-        return [dict(row) for row in rows]
+        return await fetch_equipos_por_ubicacion(conn)
     finally:
         await conn.close()
 
-@app.get("/equipos-por-estado")
-async def get_equipos_por_estado():
+# Chart endpoints backed by the materialized views in schema.sql. Each chart maps to
+# its view and to the live query used with ?fresh=1.
+CHARTS = {
+    'equipos-por-estado': ('mv_equipos_por_estado', """
+        SELECT estado, COUNT(*) as cantidad
+        FROM equipos
+        GROUP BY estado
+    """),
+    'equipos-por-categoria': ('mv_equipos_por_categoria', """
+        SELECT c.nombre, COUNT(e.id) as cantidad, COALESCE(SUM(e.costo_compra), 0) as valor_total
+        FROM categorias_equipos c
+        LEFT JOIN equipos e ON c.id = e.categoria_id
+        GROUP BY c.nombre
+    """),
+    'equipos-antiguedad': ('mv_equipos_antiguedad', """
+        SELECT 
+            CASE 
+                WHEN fecha_compra IS NULL THEN 'Desconocido'
+                WHEN DATE_PART('year', AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 'Menos de 1 año'
+                WHEN DATE_PART('year', AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 3 THEN '1-3 años'
+                WHEN DATE_PART('year', AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 5 THEN '3-5 años'
+                ELSE 'Más de 5 años'
+            END as rango,
+            COUNT(*) as cantidad
+        FROM equipos
+        GROUP BY rango
+    """),
+    'equipos-garantia': ('mv_equipos_garantia', """
+        SELECT 
+            CASE 
+                WHEN fecha_garantia_fin >= CURRENT_DATE THEN 'En Garantía'
+                ELSE 'Fuera de Garantía'
+            END as estado_garantia,
+            COUNT(*) as cantidad
+        FROM equipos
+        WHERE fecha_garantia_fin IS NOT NULL
+        GROUP BY estado_garantia
+    """),
+    'mantenimientos-por-prioridad': ('mv_mantenimientos_por_prioridad', """
+        SELECT prioridad, COUNT(*) as cantidad
+        FROM mantenimientos
+        WHERE estado IN ('programado', 'en_proceso')
+        GROUP BY prioridad
+    """),
+}
+
+MV_REFRESH_INTERVAL = float(os.getenv("REPORTES_MV_REFRESH_SECONDS", "300"))
+
+async def fetch_chart(conn, chart: str, fresh: bool = False):
+    view, live_query = CHARTS[chart]
+    if fresh:
+        rows = await conn.fetch(live_query)
+        as_of = datetime.now().astimezone()
+    else:
+        rows = await conn.fetch(f"SELECT * FROM {view}")
+        as_of = rows[0]['actualizado_en'] if rows else None
+    data = [dict(row) for row in rows]
+    for item in data:
+        item.pop('actualizado_en', None)
+    return data, as_of
+
+async def chart_response(chart: str, fresh: bool, response: Response):
     conn = await get_db_connection()
     try:
-        rows = await conn.fetch("""
-            SELECT estado, COUNT(*) as cantidad
-            FROM equipos
-            GROUP BY estado
-        """)
-        return [dict(row) for row in rows]
+        data, as_of = await fetch_chart(conn, chart, fresh)
     finally:
         await conn.close()
+    if as_of:
+        response.headers["X-Data-As-Of"] = as_of.isoformat()
+    return data
 
-@app.get("/equipos-por-categoria")
-async def get_equipos_por_categoria():
+async def refresh_materialized_views():
     conn = await get_db_connection()
     try:
-        rows = await conn.fetch("""
-            SELECT c.nombre, COUNT(e.id) as cantidad, COALESCE(SUM(e.costo_compra), 0) as valor_total
-            FROM categorias_equipos c
-            LEFT JOIN equipos e ON c.id = e.categoria_id
-            GROUP BY c.nombre
-        """)
-        return [dict(row) for row in rows]
+        # Only one replica refreshes at a time; the others skip this round
+        if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('reportes_mv_refresh'))"):
+            return False
+        try:
+            for view, _ in CHARTS.values():
+                await conn.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext('reportes_mv_refresh'))")
+        return True
     finally:
         await conn.close()
 
+async def refresh_materialized_views_loop():
+    while True:
+        await asyncio.sleep(MV_REFRESH_INTERVAL)
+        try:
+            await refresh_materialized_views()
+        except Exception as exc:
+            print(f"Error refreshing materialized views: {exc}")
+
+@app.on_event("startup")
+async def startup_event():
+    global export_pool, db_pool
+    db_pool = await asyncpg.create_pool(
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        database=os.getenv("POSTGRES_DB"),
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT"),
+        min_size=0,
+        max_size=DB_POOL_SIZE
+    )
+    # spawn: workers must not inherit the event loop or open sockets of this process
+    export_pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    if os.path.isdir(EXPORT_DIR):
+        await asyncio.to_thread(prune_export_cache)
+    if MV_REFRESH_INTERVAL > 0:
+        app.state.mv_refresh_task = asyncio.create_task(refresh_materialized_views_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    task = getattr(app.state, "mv_refresh_task", None)
+    if task:
+        task.cancel()
+    if export_pool:
+        export_pool.shutdown(wait=False, cancel_futures=True)
+    if db_pool:
+        await db_pool.close()
+
+@app.post("/vistas/refrescar")
+async def refrescar_vistas():
+    refreshed = await refresh_materialized_views()
+    if not refreshed:
+        return {"message": "Refresh already running in another process"}
+    return {"message": "Materialized views refreshed", "vistas": [view for view, _ in CHARTS.values()]}
+
+@app.get("/equipos-por-estado")
+async def get_equipos_por_estado(response: Response, fresh: bool = False):
+    return await chart_response('equipos-por-estado', fresh, response)
+
+@app.get("/equipos-por-categoria")
+async def get_equipos_por_categoria(response: Response, fresh: bool = False):
+    return await chart_response('equipos-por-categoria', fresh, response)
+
 @app.get("/equipos-antiguedad")
-async def get_equipos_antiguedad():
+async def get_equipos_antiguedad(response: Response, fresh: bool = False):
+    return await chart_response('equipos-antiguedad', fresh, response)
+
+@app.get("/mantenimientos-por-prioridad")
+async def get_mantenimientos_por_prioridad(response: Response, fresh: bool = False):
+    return await chart_response('mantenimientos-por-prioridad', fresh, response)
+
+@app.get("/equipos-garantia")
+async def get_equipos_garantia(response: Response, fresh: bool = False):
+    return await chart_response('equipos-garantia', fresh, response)
+
+async def fetch_costos_mantenimiento(conn, anio: int):
+    rows = await conn.fetch("""
+        SELECT 
+            TO_CHAR(fecha, 'Month') as mes,
+            DATE_PART('month', fecha) as mes_num,
+            tipo,
+            SUM(costo_total) as total
+        FROM mantenimiento_costos_diarios
+        WHERE fecha >= make_date($1, 1, 1)
+        AND fecha < make_date($1 + 1, 1, 1)
+        GROUP BY mes, mes_num, tipo
+        ORDER BY mes_num
+    """, anio)
+    return [dict(row) for row in rows]
+
+@app.get("/costos-mantenimiento")
+async def get_costos_mantenimiento(anio: int = 2023):
     conn = await get_db_connection()
     try:
-        # Group by years since purchase
-        rows = await conn.fetch("""
-            SELECT 
-                CASE 
-                    WHEN fecha_compra IS NULL THEN 'Desconocido'
-                    WHEN DATE_PART('year', AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 'Menos de 1 año'
-                    WHEN DATE_PART('year', AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 3 THEN '1-3 años'
-                    WHEN DATE_PART('year', AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 5 THEN '3-5 años'
-                    ELSE 'Más de 5 años'
-                END as rango,
-                COUNT(*) as cantidad
-            FROM equipos
-            GROUP BY rango
-        """)
-        return [dict(row) for row in rows]
+        return await fetch_costos_mantenimiento(conn, anio)
     finally:
         await conn.close()
 
-@app.get("/costos-mantenimiento")
-async def get_costos_mantenimiento(anio: int = 2023):
+# Months per period for /costos-mantenimiento/series
+GRANULARITIES = {'month': 1, 'quarter': 3}
+
+# (granularity, period start) -> rows. Only periods that ended before the current one
+# are stored; they are treated as immutable, so a back-dated cost edit shows up after
+# a restart or a ?fresh=true call.
+costos_cache = {}
+
+def period_start(day: date, granularity: str):
+    months = GRANULARITIES[granularity]
+    return date(day.year, (day.month - 1) // months * months + 1, 1)
+
+def add_periods(start: date, n: int, granularity: str):
+    total = start.year * 12 + start.month - 1 + n * GRANULARITIES[granularity]
+    return date(total // 12, total % 12 + 1, 1)
+
+def period_label(start: date, granularity: str):
+    if granularity == 'quarter':
+        return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    return f"{start.year}-{start.month:02d}"
+
+@app.get("/costos-mantenimiento/series")
+async def get_costos_mantenimiento_series(
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    granularity: str = "month",
+    fresh: bool = False
+):
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    hoy = date.today()
+    hasta = hasta or hoy
+    desde = desde or date(hasta.year - 1, 1, 1)
+    if desde > hasta:
+        raise HTTPException(status_code=400, detail="desde must not be after hasta")
+
+    periods = []
+    start = period_start(desde, granularity)
+    while start <= hasta:
+        periods.append(start)
+        start = add_periods(start, 1, granularity)
+    current = period_start(hoy, granularity)
+
+    missing = [p for p in periods if fresh or p >= current or (granularity, p) not in costos_cache]
+    if missing:
+        # Contiguous runs of missing periods, each read with its own range scan so cached
+        # periods between them are not read again
+        ranges = []
+        for p in missing:
+            if ranges and ranges[-1][1] == p:
+                ranges[-1][1] = add_periods(p, 1, granularity)
+            else:
+                ranges.append([p, add_periods(p, 1, granularity)])
+        conn = await get_db_connection()
+        try:
+            rows = await conn.fetch("""
+                SELECT date_trunc($3, d.fecha)::date as inicio, d.tipo, SUM(d.costo_total) as total
+                FROM unnest($1::date[], $2::date[]) as r(desde, hasta)
+                JOIN mantenimiento_costos_diarios d ON d.fecha >= r.desde AND d.fecha < r.hasta
+                GROUP BY 1, d.tipo
+                ORDER BY 1, d.tipo
+            """, [r[0] for r in ranges], [r[1] for r in ranges], granularity)
+        finally:
+            await conn.close()
+
+        computed = {p: [] for p in missing}
+        for row in rows:
+            if row['inicio'] in computed:
+                computed[row['inicio']].append({'tipo': row['tipo'], 'total': float(row['total'] or 0)})
+        for p, values in computed.items():
+            if p < current:
+                costos_cache[(granularity, p)] = values
+    else:
+        computed = {}
+
+    result = []
+    for p in periods:
+        values = computed[p] if p in computed else costos_cache[(granularity, p)]
+        for value in values:
+            result.append({'periodo': period_label(p, granularity), 'inicio': p, **value})
+    return result
+
+# Charts the Reportes page can fetch in one /bundle call
+BUNDLE_CHARTS = list(CHARTS) + ['equipos-por-ubicacion', 'costos-mantenimiento']
+
+async def fetch_bundle_chart(chart: str, fresh: bool, anio: int):
+    start = time.perf_counter()
+    try:
+        async with db_pool.acquire() as conn:
+            if chart in CHARTS:
+                data, as_of = await fetch_chart(conn, chart, fresh)
+            elif chart == 'equipos-por-ubicacion':
+                data, as_of = await fetch_equipos_por_ubicacion(conn), None
+            else:
+                data, as_of = await fetch_costos_mantenimiento(conn, anio), None
+        result = {"data": data, "as_of": as_of}
+    except Exception as exc:
+        # One failing chart must not take down the rest of the page
+        result = {"data": None, "error": str(exc)}
+    result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+@app.get("/bundle")
+async def get_bundle(response: Response, charts: Optional[str] = None, fresh: bool = False, anio: int = 2023):
+    """Several charts in one call, each on its own pooled connection, so the response
+    takes as long as the slowest chart instead of the sum of all of them."""
+    selected = list(dict.fromkeys(c.strip() for c in charts.split(',') if c.strip())) if charts else BUNDLE_CHARTS
+    unknown = [c for c in selected if c not in BUNDLE_CHARTS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown charts: {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(fetch_bundle_chart(chart, fresh, anio) for chart in selected))
+    response.headers["Server-Timing"] = ", ".join(f"{chart};dur={r['ms']}" for chart, r in zip(selected, results))
+    return {
+        "charts": dict(zip(selected, results)),
+        "ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+@app.get("/depreciacion")
+async def get_depreciacion(fecha_corte: Optional[date] = None, horizonte: int = 60):
+    """Straight-line book value of the inventory at fecha_corte and for each of the
+    next `horizonte` months, aggregated per categoria and per ubicacion."""
+    if not 0 <= horizonte <= 240:
+        raise HTTPException(status_code=400, detail="horizonte must be between 0 and 240")
+    fecha_corte = fecha_corte or date.today()
+
     conn = await get_db_connection()
     try:
-        rows = await conn.fetch("""
-            SELECT 
-                TO_CHAR(fecha_realizacion, 'Month') as mes,
-                DATE_PART('month', fecha_realizacion) as mes_num,
-                tipo,
-                SUM(costo) as total
-            FROM mantenimientos
-            WHERE fecha_realizacion IS NOT NULL 
-            AND DATE_PART('year', fecha_realizacion) = $1
-            GROUP BY mes, mes_num, tipo
-            ORDER BY mes_num
-        """, float(anio))
-        return [dict(row) for row in rows]
+        categorias = await conn.fetch("SELECT id, nombre, vida_util_anios, depreciacion_anual FROM categorias_equipos ORDER BY nombre")
+        ubicaciones = await conn.fetch("SELECT id, nombre FROM ubicaciones ORDER BY nombre")
+        # Columns come back as arrays; categoria/ubicacion as positions in the lists
+        # above (0 when unset) so no per-row UUIDs are decoded
+        row = await conn.fetchrow("""
+            SELECT array_agg(e.costo_compra::float8) FILTER (WHERE valido) as costos,
+                   array_agg((EXTRACT(YEAR FROM e.fecha_compra) * 12 + EXTRACT(MONTH FROM e.fecha_compra) - 1)::int)
+                       FILTER (WHERE valido) as meses_compra,
+                   array_agg(COALESCE(c.idx, 0)::int) FILTER (WHERE valido) as categorias,
+                   array_agg(COALESCE(u.idx, 0)::int) FILTER (WHERE valido) as ubicaciones,
+                   COUNT(*) FILTER (WHERE NOT valido) as sin_datos
+            FROM equipos e
+            LEFT JOIN unnest($1::uuid[]) WITH ORDINALITY c(id, idx) ON e.categoria_id = c.id
+            LEFT JOIN unnest($2::uuid[]) WITH ORDINALITY u(id, idx) ON e.ubicacion_actual_id = u.id,
+            LATERAL (SELECT COALESCE(e.costo_compra > 0 AND e.fecha_compra IS NOT NULL, false) as valido) v
+            WHERE e.estado IS DISTINCT FROM 'baja'
+        """, [c['id'] for c in categorias], [u['id'] for u in ubicaciones])
     finally:
         await conn.close()
 
-@app.get("/mantenimientos-por-prioridad")
-async def get_mantenimientos_por_prioridad():
+    n_cat = len(categorias) + 1
+    n_ub = len(ubicaciones) + 1
+    tasa_mensual = np.zeros(n_cat)
+    vida_meses = np.full(n_cat, np.inf)
+    for i, c in enumerate(categorias, start=1):
+        if c['vida_util_anios']:
+            vida_meses[i] = c['vida_util_anios'] * 12
+        if c['depreciacion_anual'] is not None:
+            tasa_mensual[i] = float(c['depreciacion_anual']) / 100 / 12
+        elif c['vida_util_anios']:
+            tasa_mensual[i] = 1 / vida_meses[i]
+
+    costos = np.array(row['costos'] or [], dtype=np.float64)
+    cat = np.array(row['categorias'] or [], dtype=np.int64)
+    ub = np.array(row['ubicaciones'] or [], dtype=np.int64)
+    edad = (fecha_corte.year * 12 + fecha_corte.month - 1) - np.array(row['meses_compra'] or [], dtype=np.int64)
+
+    # One pass over (categoria, ubicacion) pairs, then roll up to each dimension
+    pares = cat * n_ub + ub
+    valores = proyectar(
+        costos, edad, pares, np.repeat(tasa_mensual, n_ub), np.repeat(vida_meses, n_ub), n_cat * n_ub, horizonte
+    ).reshape(n_cat, n_ub, horizonte + 1)
+    cantidad = np.bincount(pares, minlength=n_cat * n_ub).reshape(n_cat, n_ub)
+    costo_par = np.bincount(pares, weights=costos, minlength=n_cat * n_ub).reshape(n_cat, n_ub)
+
+    def resumen(nombre, equipos, costo, serie):
+        return {
+            "nombre": nombre,
+            "equipos": int(equipos),
+            "costo_compra": round(float(costo), 2),
+            "valor_libros": np.round(serie, 2).tolist(),
+        }
+
+    nombres_cat = ["Sin categoría"] + [c['nombre'] for c in categorias]
+    nombres_ub = ["Sin ubicación"] + [u['nombre'] for u in ubicaciones]
+    por_categoria = [
+        resumen(nombres_cat[i], cantidad[i].sum(), costo_par[i].sum(), valores[i].sum(axis=0))
+        for i in range(n_cat) if cantidad[i].sum()
+    ]
+    por_ubicacion = [
+        resumen(nombres_ub[j], cantidad[:, j].sum(), costo_par[:, j].sum(), valores[:, j].sum(axis=0))
+        for j in range(n_ub) if cantidad[:, j].sum()
+    ]
+
+    inicio = fecha_corte.year * 12 + fecha_corte.month - 1
+    return {
+        "fecha_corte": fecha_corte,
+        "periodos": [f"{(inicio + t) // 12}-{(inicio + t) % 12 + 1:02d}" for t in range(horizonte + 1)],
+        "total": resumen("Total", cantidad.sum(), costo_par.sum(), valores.sum(axis=(0, 1))),
+        "por_categoria": por_categoria,
+        "por_ubicacion": por_ubicacion,
+        "sin_datos": row['sin_datos'],
+    }
+
+# Total cost of ownership: purchase cost plus maintenance (from the daily cost facts),
+# per year of service and ranked within the categoria. Window functions see every
+# equipo matching the filter, so page filters go in the outer query.
+TCO_QUERY = """
+    WITH mant AS (
+        SELECT equipo_id, SUM(costo_total) as costo_mantenimiento, SUM(cantidad) as mantenimientos
+        FROM mantenimiento_costos_diarios
+        WHERE equipo_id IS NOT NULL
+        GROUP BY equipo_id
+    ),
+    base AS (
+        SELECT e.id, e.codigo_inventario, e.nombre, e.estado, e.categoria_id, c.nombre as categoria,
+               c.vida_util_anios,
+               COALESCE(e.costo_compra, 0) as costo_compra,
+               COALESCE(m.costo_mantenimiento, 0) as costo_mantenimiento,
+               COALESCE(m.mantenimientos, 0) as mantenimientos,
+               GREATEST((CURRENT_DATE - COALESCE(e.fecha_compra, e.fecha_registro::date)) / 365.25, 1.0 / 12) as anios_servicio
+        FROM equipos e
+        LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+        LEFT JOIN mant m ON m.equipo_id = e.id
+        WHERE e.estado IS DISTINCT FROM 'baja' {filtro}
+    ),
+    tco AS (
+        SELECT *, costo_compra + costo_mantenimiento as tco,
+               ROUND((costo_compra + costo_mantenimiento) / anios_servicio, 2) as costo_por_anio,
+               ROUND(costo_mantenimiento / NULLIF(costo_compra, 0), 4) as ratio_mantenimiento
+        FROM base
+    )
+    SELECT id, codigo_inventario, nombre, estado, categoria, costo_compra, costo_mantenimiento,
+           mantenimientos, ROUND(anios_servicio, 2) as anios_servicio, tco, costo_por_anio, ratio_mantenimiento,
+           anios_servicio >= vida_util_anios as vida_util_superada,
+           SUM(costo_mantenimiento) OVER (PARTITION BY categoria_id) as costo_mantenimiento_categoria,
+           ROUND(AVG(costo_por_anio) OVER (PARTITION BY categoria_id), 2) as costo_por_anio_promedio_categoria,
+           RANK() OVER (PARTITION BY categoria_id ORDER BY costo_por_anio DESC) as ranking_categoria,
+           ROUND(PERCENT_RANK() OVER (PARTITION BY categoria_id ORDER BY costo_por_anio)::numeric, 4) as percentil_categoria,
+           COUNT(*) OVER () as total
+    FROM tco
+"""
+
+TCO_SORT_KEYS = ['tco', 'costo_por_anio', 'costo_mantenimiento', 'percentil_categoria']
+
+def encode_tco_cursor(value, id) -> str:
+    payload = json.dumps({"v": str(value), "id": str(id)})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_tco_cursor(cursor: str):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return Decimal(payload["v"]), uuid.UUID(payload["id"])
+    except (ValueError, KeyError, TypeError, AttributeError, InvalidOperation):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def tco_view(row):
+    return {k: (float(v) if isinstance(v, Decimal) else v) for k, v in row.items() if k != 'total'}
+
+@app.get("/tco")
+async def get_tco(
+    response: Response,
+    categoria_id: Optional[str] = None,
+    orden: str = Query("tco", pattern="^(tco|costo_por_anio|costo_mantenimiento|percentil_categoria)$"),
+    direccion: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None
+):
     conn = await get_db_connection()
     try:
-        rows = await conn.fetch("""
-            SELECT prioridad, COUNT(*) as cantidad
-            FROM mantenimientos
-            WHERE estado IN ('programado', 'en_proceso')
-            GROUP BY prioridad
-        """)
-        return [dict(row) for row in rows]
+        params = []
+        filtro = ""
+        if categoria_id:
+            filtro = "AND e.categoria_id = $1::uuid"
+            params.append(categoria_id)
+        query = f"SELECT * FROM ({TCO_QUERY.format(filtro=filtro)}) t"
+
+        # Keyset pagination like GET /mantenimientos: next cursor in X-Next-Cursor
+        if cursor:
+            cursor_value, cursor_id = decode_tco_cursor(cursor)
+            operator = "<" if direccion == "desc" else ">"
+            query += f" WHERE ({orden}, id) {operator} (${len(params) + 1}, ${len(params) + 2}::uuid)"
+            params.extend([cursor_value, cursor_id])
+        query += f" ORDER BY {orden} {direccion.upper()}, id {direccion.upper()} LIMIT ${len(params) + 1}"
+        params.append(limit + 1)
+
+        rows = await conn.fetch(query, *params)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            response.headers["X-Next-Cursor"] = encode_tco_cursor(rows[-1][orden], rows[-1]['id'])
+        if rows:
+            response.headers["X-Total-Count"] = str(rows[0]['total'])
+        return [tco_view(row) for row in rows]
     finally:
         await conn.close()
 
-@app.get("/equipos-garantia")
-async def get_equipos_garantia():
+@app.get("/tco/reemplazo")
+async def get_tco_reemplazo(
+    umbral: float = Query(0.5, gt=0),
+    limit: int = Query(10, ge=1, le=100),
+    categoria_id: Optional[str] = None
+):
+    """Equipos whose maintenance cost already reaches `umbral` times the purchase cost
+    (the agent's alert threshold), worst first: replace rather than repair."""
     conn = await get_db_connection()
     try:
-        rows = await conn.fetch("""
-            SELECT 
-                CASE 
-                    WHEN fecha_garantia_fin >= CURRENT_DATE THEN 'En Garantía'
-                    ELSE 'Fuera de Garantía'
-                END as estado_garantia,
-                COUNT(*) as cantidad
-            FROM equipos
-            WHERE fecha_garantia_fin IS NOT NULL
-            GROUP BY estado_garantia
-        """)
-        return [dict(row) for row in rows]
+        params = [umbral, limit]
+        filtro = ""
+        if categoria_id:
+            filtro = "AND e.categoria_id = $3::uuid"
+            params.append(categoria_id)
+        rows = await conn.fetch(f"""
+            SELECT * FROM ({TCO_QUERY.format(filtro=filtro)}) t
+            WHERE ratio_mantenimiento >= $1
+            ORDER BY ratio_mantenimiento DESC, costo_por_anio DESC
+            LIMIT $2
+        """, *params)
+        return [tco_view(row) for row in rows]
     finally:
         await conn.close()
 
 # Export Endpoints
 
 class ExportRequest(BaseModel):
-    tipo_reporte: str # 'inventario', 'mantenimientos', 'proveedores'
+    tipo_reporte: str # 'inventario', 'mantenimientos', 'movimientos', 'proveedores'
+    # Accepted for compatibility; the export queries do not filter, so it is not part of
+    # the cache or job keys either
     filtros: Optional[dict] = {}
 
-def generate_excel(data: List[dict], filename: str):
-    df = pd.DataFrame(data)
-    filepath = f"/app/reportes/{filename}"
-    df.to_excel(filepath, index=False)
-    return filepath
-
-def generate_pdf(data: List[dict], title: str, filename: str):
-    filepath = f"/app/reportes/{filename}"
-    doc = SimpleDocTemplate(filepath, pagesize=letter)
-    elements = []
-    
-    styles = getSampleStyleSheet()
-    elements.append(Paragraph(title, styles['Title']))
-    elements.append(Spacer(1, 12))
-    
-    if not data:
-        elements.append(Paragraph("No hay datos para mostrar", styles['Normal']))
-    else:
-        # Convert data to list of lists for Table
-        headers = list(data[0].keys())
-        table_data = [headers]
-        for item in data:
-            row = [str(item.get(h, '')) for h in headers]
-            table_data.append(row)
-            
-        t = Table(table_data)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ]))
-        elements.append(t)
-        
-    doc.build(elements)
-    return filepath
+EXPORT_FORMATS = {
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'pdf': ('pdf', 'application/pdf'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
 
-@app.post("/export/excel")
-async def export_excel(request: ExportRequest):
+# Raw table extracts for BI (CSV and Parquet): every column, ids included
+RAW_EXPORT_QUERIES = {
+    'inventario': """
+        SELECT e.id, e.codigo_inventario, e.nombre, e.marca, e.modelo, e.numero_serie,
+               c.nombre as categoria, u.nombre as ubicacion, p.nombre as proveedor, e.estado,
+               e.fecha_compra, e.fecha_garantia_fin, e.costo_compra, e.fecha_registro
+        FROM equipos e
+        LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+        LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+        LEFT JOIN proveedores p ON e.proveedor_id = p.id
+    """,
+    'mantenimientos': """
+        SELECT m.id, m.equipo_id, e.codigo_inventario, e.nombre as equipo, m.tipo, m.prioridad,
+               m.estado, m.fecha_programada, m.fecha_realizacion, m.costo, m.tecnico_responsable,
+               m.descripcion, m.fecha_creacion
+        FROM mantenimientos m
+        JOIN equipos e ON m.equipo_id = e.id
+    """,
+    'movimientos': """
+        SELECT mv.id, mv.equipo_id, e.codigo_inventario, u_orig.nombre as origen,
+               u_dest.nombre as destino, us.nombre as usuario, mv.fecha_movimiento, mv.motivo
+        FROM movimientos_equipos mv
+        JOIN equipos e ON mv.equipo_id = e.id
+        LEFT JOIN ubicaciones u_orig ON mv.ubicacion_origen_id = u_orig.id
+        LEFT JOIN ubicaciones u_dest ON mv.ubicacion_destino_id = u_dest.id
+        LEFT JOIN usuarios us ON mv.usuario_id = us.id
+    """,
+    'proveedores': """
+        SELECT id, nombre, ruc, contacto_nombre, contacto_email, contacto_telefono,
+               direccion, activo, fecha_registro
+        FROM proveedores
+    """,
+}
+
+EXPORT_QUERIES = {
+    'excel': {
+        'inventario': """
+            SELECT e.codigo_inventario, e.nombre, e.marca, e.modelo, 
+                   c.nombre as categoria, u.nombre as ubicacion, e.estado
+            FROM equipos e
+            LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+            LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+        """,
+        'mantenimientos': """
+            SELECT m.fecha_programada, e.nombre as equipo, m.tipo, m.estado, m.costo
+            FROM mantenimientos m
+            JOIN equipos e ON m.equipo_id = e.id
+        """,
+    },
+    # PDF rows must come ordered by the EXPORT_PDF_GROUPS column to get subtotals
+    'pdf': {
+        'inventario': """
+            SELECT c.nombre as categoria, e.codigo_inventario, e.nombre, e.estado, e.costo_compra
+            FROM equipos e
+            LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+            ORDER BY c.nombre, e.codigo_inventario
+        """,
+        'mantenimientos': """
+            SELECT m.tipo, m.fecha_programada, e.nombre as equipo, m.estado, m.costo
+            FROM mantenimientos m
+            JOIN equipos e ON m.equipo_id = e.id
+            ORDER BY m.tipo, m.fecha_programada
+        """,
+    },
+    'parquet': RAW_EXPORT_QUERIES,
+}
+
+# (group column, summed column) for the PDF subtotals
+EXPORT_PDF_GROUPS = {
+    'inventario': ('categoria', 'costo_compra'),
+    'mantenimientos': ('tipo', 'costo'),
+}
+
+# Tables each report reads; their versions (cambios_tablas) are part of the cache key
+EXPORT_TABLES = {
+    'inventario': ['equipos', 'categorias_equipos', 'ubicaciones', 'proveedores'],
+    'mantenimientos': ['mantenimientos', 'equipos'],
+    'movimientos': ['movimientos_equipos', 'equipos', 'ubicaciones', 'usuarios'],
+    'proveedores': ['proveedores'],
+}
+
+EXPORT_TITLES = {
+    'inventario': "Reporte de Inventario de Equipos",
+    'mantenimientos': "Reporte de Mantenimientos",
+}
+
+# Rendering runs in a bounded process pool so large exports don't block the event loop
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_MAX_JOBS = int(os.getenv("EXPORT_MAX_JOBS", "4"))
+EXPORT_JOB_TTL = float(os.getenv("EXPORT_JOB_TTL", "3600"))
+# Rendered files are reused until the data changes; the directory is kept under these bounds
+EXPORT_CACHE_MAX_MB = int(os.getenv("EXPORT_CACHE_MAX_MB", "1024"))
+EXPORT_CACHE_MAX_AGE = float(os.getenv("EXPORT_CACHE_MAX_AGE", "86400"))
+
+export_pool = None
+# Bounds the renders in flight. A slot is held by the render itself, which keeps running
+# when the job or request that started it is cancelled, so the bound always holds.
+export_semaphore = asyncio.Semaphore(EXPORT_MAX_JOBS)
+# Job state lives in this process: each replica serves the jobs it created
+export_jobs = {}
+export_jobs_inflight = {}
+export_cache_inflight = {}
+
+async def render_in_pool(formato: str, tipo_reporte: str, filename: str):
+    loop = asyncio.get_running_loop()
+    group_by, sum_column = EXPORT_PDF_GROUPS.get(tipo_reporte, (None, None))
+    filepath, rows = await loop.run_in_executor(
+        export_pool, render_export,
+        formato, EXPORT_QUERIES[formato][tipo_reporte], EXPORT_TITLES.get(tipo_reporte, ""), filename,
+        group_by, sum_column
+    )
+    if not rows:
+        os.remove(filepath)
+        raise LookupError("No data found for report")
+    return filepath, rows
+
+async def export_cache_key(formato: str, tipo_reporte: str):
+    tablas = EXPORT_TABLES[tipo_reporte]
     conn = await get_db_connection()
     try:
-        data = []
-        filename = f"{request.tipo_reporte}_{uuid.uuid4()}.xlsx"
-        
-        if request.tipo_reporte == 'inventario':
-            rows = await conn.fetch("""
-                SELECT e.codigo_inventario, e.nombre, e.marca, e.modelo, 
-                       c.nombre as categoria, u.nombre as ubicacion, e.estado
-                FROM equipos e
-                LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
-                LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-            """)
-            data = [dict(row) for row in rows]
-            
-        elif request.tipo_reporte == 'mantenimientos':
-            rows = await conn.fetch("""
-                SELECT m.fecha_programada, e.nombre as equipo, m.tipo, m.estado, m.costo
-                FROM mantenimientos m
-                JOIN equipos e ON m.equipo_id = e.id
-            """)
-            data = [dict(row) for row in rows]
-            
-        # Add other report types as needed
-        
-        if not data:
-            raise HTTPException(status_code=404, detail="No data found for report")
-            
-        filepath = generate_excel(data, filename)
-        return FileResponse(filepath, filename=filename, media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        
+        rows = await conn.fetch("""
+            SELECT tabla, SUM(cambios) as version
+            FROM cambios_tablas
+            WHERE tabla = ANY($1::text[])
+            GROUP BY tabla
+        """, tablas)
     finally:
         await conn.close()
+    # Tables not modified since the log was installed have no rows yet
+    versiones = {tabla: 0 for tabla in tablas}
+    versiones.update({row['tabla']: int(row['version']) for row in rows})
+    clave = json.dumps([formato, tipo_reporte, versiones], sort_keys=True, default=str)
+    return hashlib.sha256(clave.encode()).hexdigest()
+
+def prune_export_cache():
+    """Deletes exports unused for EXPORT_CACHE_MAX_AGE, then the least recently used
+    ones until the directory fits in EXPORT_CACHE_MAX_MB."""
+    limite = time.time() - EXPORT_CACHE_MAX_AGE
+    archivos = []
+    for entry in os.scandir(EXPORT_DIR):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        if stat.st_mtime < limite:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        elif not entry.name.startswith('.tmp_'):
+            archivos.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in archivos)
+    for _, size, path in sorted(archivos):
+        if total <= EXPORT_CACHE_MAX_MB * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+async def render_to_cache(formato: str, tipo_reporte: str, filepath: str):
+    # Render under a temporary name so readers never see a half-written file
+    tmp_name = f".tmp_{uuid.uuid4()}_{os.path.basename(filepath)}"
+    async with export_semaphore:
+        tmp_path, rows = await render_in_pool(formato, tipo_reporte, tmp_name)
+    os.replace(tmp_path, filepath)
+    # Scans and deletes files; keep that off the event loop
+    await asyncio.to_thread(prune_export_cache)
+    return rows
+
+async def cached_export(formato: str, tipo_reporte: str):
+    """Returns (filepath, cache hit). Files are named after the hash of the report
+    and the versions of the tables it reads."""
+    clave = await export_cache_key(formato, tipo_reporte)
+    extension, _ = EXPORT_FORMATS[formato]
+    filepath = f"{EXPORT_DIR}/{tipo_reporte}_{clave[:32]}.{extension}"
+    if os.path.exists(filepath):
+        # mtime doubles as last-used time for eviction
+        os.utime(filepath)
+        return filepath, True
+
+    # Concurrent misses for the same file share one render
+    task = export_cache_inflight.get(filepath)
+    if task is None:
+        task = asyncio.create_task(render_to_cache(formato, tipo_reporte, filepath))
+        export_cache_inflight[filepath] = task
+        task.add_done_callback(lambda _: export_cache_inflight.pop(filepath, None))
+    # A cancelled caller does not abort the render; the file still lands in the cache
+    await asyncio.shield(task)
+    return filepath, False
+
+async def export_file(formato: str, request: ExportRequest):
+    if request.tipo_reporte not in EXPORT_QUERIES[formato]:
+        raise HTTPException(status_code=404, detail="No data found for report")
+
+    _, media_type = EXPORT_FORMATS[formato]
+    try:
+        filepath, hit = await cached_export(formato, request.tipo_reporte)
+    except LookupError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    return FileResponse(
+        filepath, filename=os.path.basename(filepath), media_type=media_type,
+        headers={"X-Cache": "HIT" if hit else "MISS"}
+    )
+
+@app.post("/export/excel")
+async def export_excel(request: ExportRequest):
+    return await export_file('excel', request)
 
 @app.post("/export/pdf")
 async def export_pdf(request: ExportRequest):
+    return await export_file('pdf', request)
+
+@app.post("/export/parquet")
+async def export_parquet(request: ExportRequest):
+    return await export_file('parquet', request)
+
+async def stream_csv(query: str):
+    # COPY ... TO STDOUT hands us raw CSV bytes; they go to the client as they arrive
+    # without building a Python object per row. The bounded queue applies backpressure
+    # to the COPY when the client reads slowly.
+    queue = asyncio.Queue(maxsize=16)
     conn = await get_db_connection()
+
+    async def produce():
+        try:
+            await conn.copy_from_query(query, output=queue.put, format='csv', header=True)
+        except Exception as exc:
+            await queue.put(exc)
+            return
+        await queue.put(None)
+
+    task = asyncio.create_task(produce())
     try:
-        data = []
-        filename = f"{request.tipo_reporte}_{uuid.uuid4()}.pdf"
-        title = ""
-        
-        if request.tipo_reporte == 'inventario':
-            title = "Reporte de Inventario de Equipos"
-            rows = await conn.fetch("""
-                SELECT e.codigo_inventario, e.nombre, c.nombre as categoria, e.estado
-                FROM equipos e
-                LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
-                LIMIT 100 -- Limit for PDF readability
-            """)
-            data = [dict(row) for row in rows]
-            
-        elif request.tipo_reporte == 'mantenimientos':
-            title = "Reporte de Mantenimientos"
-            rows = await conn.fetch("""
-                SELECT m.fecha_programada, e.nombre as equipo, m.tipo, m.estado
-                FROM mantenimientos m
-                JOIN equipos e ON m.equipo_id = e.id
-                LIMIT 100
-            """)
-            data = [dict(row) for row in rows]
-            
-        if not data:
-            raise HTTPException(status_code=404, detail="No data found for report")
-            
-        filepath = generate_pdf(data, title, filename)
-        return FileResponse(filepath, filename=filename, media_type='application/pdf')
-        
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield bytes(chunk)
     finally:
+        if not task.done():
+            # Client went away mid-stream; let the COPY unwind before closing its connection
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
         await conn.close()
+
+@app.post("/export/csv")
+async def export_csv(request: ExportRequest):
+    query = RAW_EXPORT_QUERIES.get(request.tipo_reporte)
+    if not query:
+        raise HTTPException(status_code=404, detail="No data found for report")
+    return StreamingResponse(
+        stream_csv(query),
+        media_type='text/csv',
+        headers={"Content-Disposition": f'attachment; filename="{request.tipo_reporte}.csv"'}
+    )
+
+# Export jobs
+
+class ExportJobRequest(ExportRequest):
+    formato: str = "excel" # 'excel', 'pdf', 'parquet'
+
+def export_job_view(job: dict):
+    return {k: v for k, v in job.items() if k not in ('task', 'clave', 'archivo')}
+
+def prune_export_jobs():
+    # Files belong to the export cache and are evicted by prune_export_cache
+    limite = time.time() - EXPORT_JOB_TTL
+    for job_id, job in list(export_jobs.items()):
+        if job.get('terminado_en') and job['terminado_en'] < limite:
+            del export_jobs[job_id]
+
+async def run_export_job(job: dict):
+    try:
+        job['estado'] = 'en_proceso'
+        job['progreso'] = 10
+        # Waits for a render slot (export_semaphore) only on a cache miss
+        job['archivo'], job['cache_hit'] = await cached_export(job['formato'], job['tipo_reporte'])
+        job['estado'] = 'completado'
+        job['progreso'] = 100
+    except asyncio.CancelledError:
+        # A render already running finishes on its own, keeping its slot, and is kept
+        # in the export cache
+        job['estado'] = 'cancelado'
+    except Exception as exc:
+        job['estado'] = 'error'
+        job['error'] = str(exc)
+    finally:
+        job['terminado_en'] = time.time()
+        if export_jobs_inflight.get(job['clave']) == job['id']:
+            del export_jobs_inflight[job['clave']]
+
+@app.post("/export/jobs")
+async def create_export_job(request: ExportJobRequest):
+    if request.formato not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"formato must be one of {', '.join(EXPORT_FORMATS)}")
+    if request.tipo_reporte not in EXPORT_QUERIES[request.formato]:
+        raise HTTPException(status_code=400, detail="Unsupported tipo_reporte")
+
+    prune_export_jobs()
+
+    # Identical requests already queued or running share the same job
+    clave = json.dumps([request.formato, request.tipo_reporte])
+    existing = export_jobs_inflight.get(clave)
+    if existing:
+        return export_job_view(export_jobs[existing])
+
+    job_id = str(uuid.uuid4())
+    extension, _ = EXPORT_FORMATS[request.formato]
+    filename = f"{request.tipo_reporte}_{job_id}.{extension}"
+    job = {
+        'id': job_id,
+        'clave': clave,
+        'formato': request.formato,
+        'tipo_reporte': request.tipo_reporte,
+        'estado': 'pendiente',
+        'progreso': 0,
+        'error': None,
+        'filename': filename,
+        'archivo': None,
+        'cache_hit': None,
+        'creado_en': time.time(),
+        'terminado_en': None,
+    }
+    export_jobs[job_id] = job
+    export_jobs_inflight[clave] = job_id
+    job['task'] = asyncio.create_task(run_export_job(job))
+    return export_job_view(job)
+
+@app.get("/export/jobs/{id}")
+async def get_export_job(id: str):
+    job = export_jobs.get(id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return export_job_view(job)
+
+@app.get("/export/jobs/{id}/download")
+async def download_export_job(id: str):
+    job = export_jobs.get(id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job['estado'] != 'completado':
+        raise HTTPException(status_code=409, detail=f"Export job is {job['estado']}")
+    if not os.path.exists(job['archivo']):
+        raise HTTPException(status_code=410, detail="Export file was evicted from the cache")
+    _, media_type = EXPORT_FORMATS[job['formato']]
+    return FileResponse(
+        job['archivo'], filename=job['filename'], media_type=media_type,
+        headers={"X-Cache": "HIT" if job['cache_hit'] else "MISS"}
+    )
+
+@app.delete("/export/jobs/{id}")
+async def cancel_export_job(id: str):
+    job = export_jobs.get(id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job['estado'] in ('pendiente', 'en_proceso'):
+        # A task cancelled before it first runs never reaches its handler, so the state
+        # is set here
+        job['task'].cancel()
+        job['estado'] = 'cancelado'
+        job['terminado_en'] = time.time()
+        if export_jobs_inflight.get(job['clave']) == id:
+            del export_jobs_inflight[job['clave']]
+        return {"message": "Export job cancelled"}
+    return {"message": f"Export job already {job['estado']}"}
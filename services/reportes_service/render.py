@@ -0,0 +1,300 @@
+# Report renderers. They run inside the export ProcessPoolExecutor, so this module
+# must stay importable without the FastAPI app. Each worker reads its rows straight
+# from the database instead of receiving them pickled from the web process.
+import asyncio
+import asyncpg
+import itertools
+import os
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+from openpyxl import Workbook
+import pyarrow as pa
+import pyarrow.parquet as pq
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter, landscape
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Frame, LongTable, TableStyle, Paragraph, Spacer
+from reportlab.platypus.doctemplate import LayoutError
+from reportlab.lib.styles import getSampleStyleSheet
+
+EXPORT_DIR = "/app/reportes"
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+
+async def get_db_connection():
+    return await asyncpg.connect(
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        database=os.getenv("POSTGRES_DB"),
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT")
+    )
+
+class ExcelStreamWriter:
+    """xlsx writer whose memory use does not grow with the number of rows.
+
+    openpyxl's write-only mode serializes each appended row to a temp file, so only
+    the current chunk is held in memory.
+    """
+
+    def __init__(self, filepath: str, columns: List[str]):
+        self.filepath = filepath
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Reporte")
+        self.sheet.append(columns)
+        self.rows = 0
+
+    def write(self, rows):
+        for row in rows:
+            self.sheet.append(list(row))
+        self.rows += len(rows)
+
+    def close(self):
+        self.workbook.save(self.filepath)
+
+# Postgres type -> Arrow type for Parquet exports. numeric columns in the schema
+# have at most 2 decimals, so decimal128(38, 6) holds them exactly.
+PARQUET_TYPES = {
+    'uuid': pa.string(),
+    'text': pa.string(),
+    'varchar': pa.string(),
+    'bpchar': pa.string(),
+    'json': pa.string(),
+    'jsonb': pa.string(),
+    'bool': pa.bool_(),
+    'int2': pa.int16(),
+    'int4': pa.int32(),
+    'int8': pa.int64(),
+    'float4': pa.float32(),
+    'float8': pa.float64(),
+    'numeric': pa.decimal128(38, 6),
+    'date': pa.date32(),
+    'timestamp': pa.timestamp('us'),
+    'timestamptz': pa.timestamp('us', tz='UTC'),
+}
+
+class ParquetStreamWriter:
+    """Writes each cursor chunk as one Arrow record batch, typed from the query's columns."""
+
+    def __init__(self, filepath: str, attributes):
+        self.schema = pa.schema([
+            (attr.name, PARQUET_TYPES.get(attr.type.name, pa.string())) for attr in attributes
+        ])
+        # Values that Arrow can't take as-is (uuid.UUID) are written as text
+        self.as_text = [PARQUET_TYPES.get(attr.type.name) in (None, pa.string()) for attr in attributes]
+        self.writer = pq.ParquetWriter(filepath, self.schema)
+        self.rows = 0
+
+    def write(self, rows):
+        arrays = []
+        for idx, field in enumerate(self.schema):
+            values = [row[idx] for row in rows]
+            if self.as_text[idx]:
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(pa.array(values, type=field.type))
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.rows += len(rows)
+
+    def close(self):
+        self.writer.close()
+
+class PdfReport:
+    """Paginated PDF report built from row chunks.
+
+    Rows become LongTable blocks of PDF_BLOCK_ROWS with a repeated header and fixed
+    column widths, so layout cost grows linearly instead of with one giant Table. Pages
+    are laid out as blocks come out of the generator, so only the block being placed
+    (and the remainder of its last split) is in memory; reportlab still keeps each
+    finished page's content stream, a few hundred bytes per row, until save. When
+    group_by is set, rows
+    must arrive ordered by that column; a subtotal row (count and sum_column) closes
+    each group and a grand total ends the report.
+    """
+
+    BLOCK_ROWS = int(os.getenv("PDF_BLOCK_ROWS", "500"))
+    FONT_SIZE = 7
+
+    def __init__(self, filepath: str, columns: List[str], title: str, group_by: str = None, sum_column: str = None):
+        self.filepath = filepath
+        self.columns = columns
+        self.title = title
+        self.group_idx = columns.index(group_by) if group_by in columns else None
+        self.sum_idx = columns.index(sum_column) if sum_column in columns else None
+        self.rows = 0
+
+        self.pagesize = landscape(letter)
+        col_width = (self.pagesize[0] - 60) / len(columns)
+        self.col_widths = [col_width] * len(columns)
+        # Approximate characters that fit in a cell at FONT_SIZE
+        self.max_chars = max(4, int(col_width / (self.FONT_SIZE * 0.5)))
+        self.styles = getSampleStyleSheet()
+
+    def _cell(self, value):
+        text = '' if value is None else str(value)
+        return text if len(text) <= self.max_chars else text[:self.max_chars - 1] + '…'
+
+    def _total_row(self, label: str, count: int, total: Decimal):
+        row = [''] * len(self.columns)
+        row[0] = self._cell(label)
+        row[1 if len(row) > 1 else 0] = f"{count} registros"
+        if self.sum_idx is not None:
+            row[self.sum_idx] = f"{total:,.2f}"
+        return row
+
+    def _table(self, block, total_rows_idx):
+        table = LongTable([self.columns] + block, colWidths=self.col_widths, repeatRows=1)
+        style = [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), self.FONT_SIZE),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ]
+        for idx in total_rows_idx:
+            style.append(('FONTNAME', (0, idx), (-1, idx), 'Helvetica-Bold'))
+            style.append(('BACKGROUND', (0, idx), (-1, idx), colors.lightgrey))
+        table.setStyle(TableStyle(style))
+        return table
+
+    def _flowables(self, chunks):
+        block, total_rows_idx = [], []
+        group_value, group_count = None, 0
+        group_sum, total_sum = Decimal(0), Decimal(0)
+
+        for rows in chunks:
+            for row in rows:
+                if self.group_idx is not None and row[self.group_idx] != group_value:
+                    if group_count:
+                        total_rows_idx.append(len(block) + 1)
+                        block.append(self._total_row(f"Subtotal {group_value or 'Sin asignar'}", group_count, group_sum))
+                    group_value, group_count, group_sum = row[self.group_idx], 0, Decimal(0)
+
+                value = row[self.sum_idx] if self.sum_idx is not None else None
+                if value is not None:
+                    group_sum += Decimal(value)
+                    total_sum += Decimal(value)
+                group_count += 1
+                self.rows += 1
+                block.append([self._cell(v) for v in row])
+
+                if len(block) >= self.BLOCK_ROWS:
+                    yield self._table(block, total_rows_idx)
+                    block, total_rows_idx = [], []
+
+        if not self.rows:
+            yield Paragraph("No hay datos para mostrar", self.styles['Normal'])
+            return
+
+        if self.group_idx is not None:
+            total_rows_idx.append(len(block) + 1)
+            block.append(self._total_row(f"Subtotal {group_value or 'Sin asignar'}", group_count, group_sum))
+        total_rows_idx.append(len(block) + 1)
+        block.append(self._total_row("Total general", self.rows, total_sum))
+        yield self._table(block, total_rows_idx)
+
+    def _draw_page_number(self, canvas, page: int):
+        canvas.setFont('Helvetica', 8)
+        canvas.drawRightString(self.pagesize[0] - 30, 15, f"{self.title} - Página {page}")
+
+    def build(self, chunks):
+        width, height = self.pagesize
+        canvas = Canvas(self.filepath, pagesize=self.pagesize)
+        canvas.setTitle(self.title)
+        header = [
+            Paragraph(self.title, self.styles['Title']),
+            Paragraph(f"Generado: {datetime.now():%Y-%m-%d %H:%M}", self.styles['Normal']),
+            Spacer(1, 12),
+        ]
+        story = itertools.chain(header, self._flowables(chunks))
+        # Parts of a split flowable still to be placed on the next pages
+        pending = []
+        page, frame, placed = 0, None, 0
+
+        while True:
+            flowable = pending.pop(0) if pending else next(story, None)
+            if flowable is None:
+                break
+            if frame is None:
+                page += 1
+                frame, placed = Frame(30, 30, width - 60, height - 60), 0
+            if frame.add(flowable, canvas):
+                placed += 1
+                continue
+            parts = frame.split(flowable, canvas)
+            if parts and frame.add(parts[0], canvas):
+                pending[:0] = parts[1:]
+            elif placed:
+                pending.insert(0, flowable)
+            else:
+                raise LayoutError(f"{type(flowable).__name__} does not fit on an empty page")
+            self._draw_page_number(canvas, page)
+            canvas.showPage()
+            frame = None
+
+        if frame is not None:
+            self._draw_page_number(canvas, page)
+            canvas.showPage()
+        canvas.save()
+
+def iter_query_chunks(query: str):
+    """Yields the column attributes (name, type), then chunks of rows from a server-side cursor.
+
+    Runs its own event loop so synchronous consumers (openpyxl, reportlab) can pull
+    rows on demand.
+    """
+    loop = asyncio.new_event_loop()
+    conn = None
+    try:
+        conn = loop.run_until_complete(get_db_connection())
+        # Server-side cursors only live inside a transaction
+        transaction = conn.transaction(readonly=True)
+        loop.run_until_complete(transaction.start())
+        stmt = loop.run_until_complete(conn.prepare(query))
+        yield stmt.get_attributes()
+
+        cursor = loop.run_until_complete(stmt.cursor())
+        while True:
+            rows = loop.run_until_complete(cursor.fetch(EXPORT_CHUNK_SIZE))
+            if not rows:
+                break
+            yield rows
+        loop.run_until_complete(transaction.commit())
+    finally:
+        if conn is not None:
+            loop.run_until_complete(conn.close())
+        loop.close()
+
+def generate_excel(query: str, filename: str):
+    filepath = f"{EXPORT_DIR}/{filename}"
+    chunks = iter_query_chunks(query)
+    writer = ExcelStreamWriter(filepath, [attr.name for attr in next(chunks)])
+    for rows in chunks:
+        writer.write(rows)
+    writer.close()
+    return filepath, writer.rows
+
+def generate_pdf(query: str, title: str, filename: str, group_by: str = None, sum_column: str = None):
+    filepath = f"{EXPORT_DIR}/{filename}"
+    chunks = iter_query_chunks(query)
+    report = PdfReport(filepath, [attr.name for attr in next(chunks)], title, group_by, sum_column)
+    report.build(chunks)
+    return filepath, report.rows
+
+def generate_parquet(query: str, filename: str):
+    filepath = f"{EXPORT_DIR}/{filename}"
+    chunks = iter_query_chunks(query)
+    writer = ParquetStreamWriter(filepath, next(chunks))
+    for rows in chunks:
+        writer.write(rows)
+    writer.close()
+    return filepath, writer.rows
+
+def render_export(formato: str, query: str, title: str, filename: str, group_by: str = None, sum_column: str = None):
+    """Renders a report in a worker process. Returns (filepath, row count)."""
+    if formato == 'pdf':
+        return generate_pdf(query, title, filename, group_by, sum_column)
+    if formato == 'parquet':
+        return generate_parquet(query, filename)
+    return generate_excel(query, filename)